@@ -1,12 +1,18 @@
+from array import array
+
+
 class AttributeNode(object):
 
-    def __init__(self, attribute_name):
+    def __init__(self, attribute_name, default=None):
         """
         Construct a node with attribute name.
         :param attribute_name: a given name for node.
+        :param default: The class to predict for a value that has no child.
         """
         self.attribute = attribute_name
+        self.default = default
         self.dict = {}
+        self.summary = None
 
     def add_child_to_dict(self, value, child):
         """
@@ -24,6 +30,8 @@ class AttributeNode(object):
         :return: The prediction.
         """
         value = entry.get_attribute_value(self.attribute)
+        if value not in self.dict:
+            return self.default
         return self.dict[value].predict(entry)
 
     def tree_as_string(self, space_number=0):
@@ -61,6 +69,7 @@ class ClassNode(object):
         :param class_name: The class name.
         """
         self.class_name = class_name
+        self.summary = None
 
     def predict(self, entry=None):
         """
@@ -76,3 +85,123 @@ class ClassNode(object):
         :return:
         """
         return self.class_name
+
+
+class NodeSummary(object):
+
+    def __init__(self, attributes, default, class_counter, count_table=None, rows=None):
+        """
+        Construct the counts of the rows of a node, kept by an incremental ID3 to update the tree.
+        :param attributes: The attributes left for the node.
+        :param default: The default class the node got from its parent.
+        :param class_counter: The classes counter of the rows of the node.
+        :param count_table: The count table of the attributes of an attribute node, see DataObject.count_table.
+        :param rows: The rows of a class node.
+        """
+        self.attributes = attributes
+        self.default = default
+        self.class_counter = class_counter
+        self.count_table = count_table
+        self.rows = rows
+
+
+class CompiledTree(object):
+    ARRAYS_NAMES = ('features', 'offsets', 'widths', 'node_classes', 'children')
+
+    def __init__(self, root, data):
+        """
+        Flatten a tree of attribute nodes and class nodes into arrays, node 0 is the root:
+         features[node] - the index of the attribute of the node, -1 for a class node.
+         offsets[node] - where the children of the node start in children, children[offsets[node] + code] is the
+          child for the value with that code or -1 if there is no such child.
+         widths[node] - how many children slots the node has, the number of values of its attribute.
+         node_classes[node] - the index in classes of the class of a class node, or of the default of an attribute
+          node, that is used for values without a child.
+        :param root: The root of the tree.
+        :param data: The data object that encodes the values, or a view of it.
+        """
+        data = data.get_source()  # a view knows only the values of its rows, the codes are of the source
+        self.root = root
+        self.classes = []
+        self.features = array('i')
+        self.offsets = array('i')
+        self.widths = array('i')
+        self.node_classes = array('i')
+        self.children = array('i')
+
+        classes_indexes = {}
+        nodes = [root]
+        # nodes are numbered in the order they are added, so every node gets its number before its children
+        for node in nodes:
+            if isinstance(node, ClassNode):
+                class_name, feature, values = node.class_name, -1, []
+            else:
+                class_name, feature = node.default, data.attributes_indexes[node.attribute]
+                values = data.dict_of_attributes[node.attribute]
+
+            if class_name not in classes_indexes:
+                classes_indexes[class_name] = len(self.classes)
+                self.classes.append(class_name)
+            self.node_classes.append(classes_indexes[class_name])
+            self.features.append(feature)
+            self.offsets.append(len(self.children))
+            self.widths.append(len(values))
+
+            for value in values:
+                child = node.dict.get(value)
+                if child is None:
+                    self.children.append(-1)
+                else:
+                    self.children.append(len(nodes))
+                    nodes.append(child)
+
+    @staticmethod
+    def from_arrays(classes, arrays):
+        """
+        Build a compiled tree from its arrays, that may be memory views of a model file. It has no root.
+        :param classes: The classes of the tree.
+        :param arrays: The arrays, see get_arrays.
+        :return: The compiled tree.
+        """
+        compiled_tree = CompiledTree.__new__(CompiledTree)
+        compiled_tree.root = None
+        compiled_tree.classes = list(classes)
+        for name in CompiledTree.ARRAYS_NAMES:
+            setattr(compiled_tree, name, arrays[name])
+        return compiled_tree
+
+    def get_arrays(self):
+        """
+        Return the arrays of the compiled tree.
+        :return: {name: array}.
+        """
+        return {name: getattr(self, name) for name in CompiledTree.ARRAYS_NAMES}
+
+    def predict_codes(self, codes):
+        """
+        Predict the class for encoded values, walking the arrays without recursion.
+        :param codes: The codes of the values, -1 for a value the data never had.
+        :return: The prediction.
+        """
+        node = 0
+        while True:
+            feature = self.features[node]
+            if feature < 0:
+                return self.classes[self.node_classes[node]]
+            code = codes[feature]
+            child = self.children[self.offsets[node] + code] if 0 <= code < self.widths[node] else -1
+            if child < 0:
+                return self.classes[self.node_classes[node]]
+            node = child
+
+    def predict_batch(self, rows):
+        """
+        Predict many encoded rows, every distinct row walks the arrays only once.
+        :param rows: Codes tuples, see DataObject.encode_rows.
+        :return: List of the predictions.
+        """
+        predictions = {}
+        for row in rows:
+            if row not in predictions:
+                predictions[row] = self.predict_codes(row)
+        return [predictions[row] for row in rows]
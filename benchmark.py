@@ -0,0 +1,235 @@
+import argparse
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+import tracemalloc
+
+from data_loader import load_data
+from data_object import DataObject
+from attribute_node import AttributeNode
+from id3_algorithm import ID3
+from instrumentation import percentile
+from knn_algo import Knn
+from naive_bayes_algorithm import NaiveBayes
+
+PERCENTILES = (50, 90, 99)
+
+
+def iter_synthetic_rows(rows, attributes_number=3, cardinality=4, classes_number=2, seed=0):
+    """
+    Generate random categorical rows in the shape of train.txt. The class depends on the first two attributes, with
+    some noise, so the trees have something to learn.
+    :param rows: The number of rows.
+    :param attributes_number: The number of attributes.
+    :param cardinality: The number of values of every attribute.
+    :param classes_number: The number of classes.
+    :param seed: The random seed.
+    :return: Generator of (values, class) for every row.
+    """
+    generator = random.Random(seed)
+    values = ['v%d' % i for i in range(cardinality)]
+    classes = ['class%d' % i for i in range(classes_number)]
+
+    for _ in range(rows):
+        codes = [generator.randrange(cardinality) for _ in range(attributes_number)]
+        if generator.random() < 0.1:
+            class_index = generator.randrange(classes_number)
+        else:
+            class_index = sum(codes[:2]) % classes_number
+        yield [values[code] for code in codes], classes[class_index]
+
+
+def make_synthetic_data(rows, attributes_number=3, cardinality=4, classes_number=2, seed=0):
+    """
+    Generate a random categorical data object, see iter_synthetic_rows.
+    :return: The data object.
+    """
+    data = DataObject(['attr%d' % i for i in range(attributes_number)])
+    for values, entry_class in iter_synthetic_rows(rows, attributes_number, cardinality, classes_number, seed):
+        data.add_row(values, entry_class)
+    return data
+
+
+def write_synthetic_file(file_path, rows, attributes_number=3, cardinality=4, classes_number=2, seed=0):
+    """
+    Write random rows as a tab separated file like train.txt, the class is the last column, see iter_synthetic_rows.
+    :param file_path: The path of the file.
+    :return: None.
+    """
+    with open(file_path, 'w') as tsv_file:
+        tsv_file.write('\t'.join(['attr%d' % i for i in range(attributes_number)] + ['class']) + '\n')
+        tsv_file.writelines('\t'.join(values + [entry_class]) + '\n' for values, entry_class in
+                            iter_synthetic_rows(rows, attributes_number, cardinality, classes_number, seed))
+
+
+def measure(function, *args):
+    """
+    Run a function twice, once for the time and once under tracemalloc for the peak memory, which slows it down.
+    :param function: The function.
+    :param args: The arguments of the function.
+    :return: (result of the first run, {'seconds': .., 'peak_memory_bytes': ..}).
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    try:
+        function(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return result, {'seconds': seconds, 'peak_memory_bytes': peak}
+
+
+def measure_prediction(algorithm, rows):
+    """
+    Time the batch prediction of the rows for the throughput, and a batch of every row alone for the latency.
+    :param algorithm: The algorithm, with predict_batch.
+    :param rows: The encoded rows, see DataObject.encode_rows.
+    :return: {'rows_per_second': .., 'latency_seconds': {'p50': .., ..}}.
+    """
+    start = time.perf_counter()
+    algorithm.predict_batch(rows)
+    seconds = time.perf_counter() - start
+
+    latencies = []
+    for row in rows:
+        start = time.perf_counter()
+        algorithm.predict_batch([row])
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    return {'rows_per_second': len(rows) / seconds if seconds else None,
+            'latency_seconds': {'p%d' % percent: percentile(latencies, percent) for percent in PERCENTILES}}
+
+
+def count_nodes(node):
+    """
+    Count the nodes of a tree.
+    :param node: The root of the tree.
+    :return: The number of attribute nodes and class nodes.
+    """
+    if isinstance(node, AttributeNode):
+        return 1 + sum(count_nodes(child) for child in node.dict.values())
+    return 1
+
+
+def benchmark_classifiers(rows, attributes_number=3, cardinality=4, classes_number=2, test_rows=1000, k=5, seed=0,
+                          id3_options=None):
+    """
+    Time every step of the classifiers on a synthetic data set: loading the train file, building every model and
+    predicting test rows. The models are built without the prediction cache, so every prediction is computed.
+    :param rows: The number of train rows.
+    :param attributes_number: The number of attributes.
+    :param cardinality: The number of values of every attribute.
+    :param classes_number: The number of classes.
+    :param test_rows: The number of test rows, they are generated with another seed.
+    :param k: The k of Knn.
+    :param seed: The random seed.
+    :param id3_options: Keyword arguments of ID3, like its limits max_depth or min_gain.
+    :return: The results, a dictionary that can be written as JSON.
+    """
+    results = {'dataset': {'rows': rows, 'attributes': attributes_number, 'cardinality': cardinality,
+                           'classes': classes_number, 'test_rows': test_rows, 'seed': seed},
+               'python': platform.python_version()}
+
+    file_descriptor, file_path = tempfile.mkstemp(suffix='.txt')
+    os.close(file_descriptor)
+    try:
+        write_synthetic_file(file_path, rows, attributes_number, cardinality, classes_number, seed)
+        data, results['load'] = measure(load_data, file_path)
+    finally:
+        os.remove(file_path)
+    results['load']['rows_per_second'] = rows / results['load']['seconds'] if results['load']['seconds'] else None
+
+    test_data = make_synthetic_data(test_rows, attributes_number, cardinality, classes_number, seed + 1)
+    test_entries = [test_data.get_entry(row) for row in range(test_data.total_count)]
+    test_rows_codes = data.encode_rows(test_data.get_all_attributes(),
+                                       [entry.attributes for entry in test_entries])
+
+    default = max(data.class_counter.items(), key=lambda x: x[1])[0]
+    id3 = ID3(data, cache=None, **(id3_options or {}))
+    tree, results['id3_generate_tree'] = measure(id3.generate_tree, data, data.get_all_attributes(), default)
+    results['id3_generate_tree']['options'] = id3_options or {}
+    results['id3_generate_tree']['nodes'] = count_nodes(tree)
+    results['id3_generate_tree']['nodes_per_second'] = count_nodes(tree) / results['id3_generate_tree']['seconds']
+    id3.compile()
+    results['id3_predict'] = measure_prediction(id3, test_rows_codes)
+
+    knn, results['knn_build'] = measure(Knn, data, k, None)
+    results['knn_predict'] = measure_prediction(knn, test_rows_codes)
+
+    naive_bayes, results['naive_bayes_build'] = measure(NaiveBayes, data, None, None)
+    results['naive_bayes_predict'] = measure_prediction(naive_bayes, test_rows_codes)
+
+    return results
+
+
+def benchmark_parallel_id3(data, workers_options=None):
+    """
+    Time the serial and the parallel build of ID3 for some numbers of processes.
+    :param data: The data to build the trees on.
+    :param workers_options: The numbers of processes to try, None for powers of 2 up to the number of cpus.
+    :return: {workers: seconds}, workers 0 is the serial build.
+    """
+    if workers_options is None:
+        workers_options = [2 ** i for i in range((os.cpu_count() or 1).bit_length())]
+    default = max(data.class_counter.items(), key=lambda x: x[1])[0]
+    results = {}
+
+    start = time.perf_counter()
+    serial_tree = ID3(data).generate_tree(data, data.get_all_attributes(), default)
+    results[0] = time.perf_counter() - start
+
+    for workers in workers_options:
+        start = time.perf_counter()
+        tree = ID3(data).generate_tree_parallel(data, data.get_all_attributes(), default, workers=workers)
+        results[workers] = time.perf_counter() - start
+        if tree.tree_as_string() != serial_tree.tree_as_string():
+            raise AssertionError('the parallel tree with %d workers is not the serial tree' % workers)
+
+    return results
+
+
+if __name__ == '__main__':
+    """
+    Benchmark the classifiers on a synthetic data set and write the results as JSON, or print the speedup of the
+    parallel ID3 build with --parallel.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the classifiers on synthetic categorical data.')
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--attributes', type=int, default=8)
+    parser.add_argument('--cardinality', type=int, default=4)
+    parser.add_argument('--classes', type=int, default=2)
+    parser.add_argument('--test-rows', type=int, default=1000)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-depth', type=int, help='the max_depth of ID3')
+    parser.add_argument('--min-samples-split', type=int, default=2, help='the min_samples_split of ID3')
+    parser.add_argument('--min-gain', type=float, help='the min_gain of ID3')
+    parser.add_argument('--consolidate', action='store_true', help='consolidate the tree of ID3')
+    parser.add_argument('--output', default='benchmark.json', help='the JSON file of the results')
+    parser.add_argument('--parallel', action='store_true', help='only compare the parallel ID3 build')
+    arguments = parser.parse_args()
+
+    if arguments.parallel:
+        synthetic_data = make_synthetic_data(arguments.rows, arguments.attributes, arguments.cardinality,
+                                             arguments.classes, arguments.seed)
+        timings = benchmark_parallel_id3(synthetic_data)
+        print('serial: %.3fs' % timings[0])
+        for workers_number, seconds in sorted(timings.items())[1:]:
+            print('%d workers: %.3fs, speedup %.2f' % (workers_number, seconds, timings[0] / seconds))
+    else:
+        limits = {'max_depth': arguments.max_depth, 'min_samples_split': arguments.min_samples_split,
+                  'min_gain': arguments.min_gain, 'consolidate': arguments.consolidate}
+        benchmark_results = benchmark_classifiers(arguments.rows, arguments.attributes, arguments.cardinality,
+                                                  arguments.classes, arguments.test_rows, arguments.k,
+                                                  arguments.seed, limits)
+        with open(arguments.output, 'w') as json_file:
+            json.dump(benchmark_results, json_file, indent=2)
+        print(json.dumps(benchmark_results, indent=2))
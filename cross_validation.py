@@ -0,0 +1,188 @@
+import os
+import random
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+from data_object import DataView, attach_shared_data, shared_data
+from id3_algorithm import ID3
+from knn_algo import Knn
+from naive_bayes_algorithm import NaiveBayes
+from random_forest import RandomForest
+
+MODELS = ('ID3', 'Knn', 'NaiveBayes', 'RandomForest')
+
+
+def make_grid(model, **parameters_options):
+    """
+    Make the configurations of a model for every combination of the parameters options, like
+     make_grid('Knn', k=[1, 3, 5]) -> [('Knn', {'k': 1}), ('Knn', {'k': 3}), ('Knn', {'k': 5})].
+    :param model: The name of the model, one of MODELS.
+    :param parameters_options: A list of values for every parameter of the model.
+    :return: List of (model, parameters) configurations.
+    """
+    if model not in MODELS:
+        raise ValueError('unknown model %s' % model)
+    names = list(parameters_options)
+    return [(model, dict(zip(names, values))) for values in product(*parameters_options.values())]
+
+
+def make_folds(data, folds_number, seed=None):
+    """
+    Split the rows of data into folds. Every fold is a pair of arrays of the indexes of the rows in the source data
+    object, the train rows and the test rows, both in the order of data so the models see the rows in that order.
+    :param data: The data object or a view.
+    :param folds_number: The number of folds.
+    :param seed: The seed to shuffle the rows with, None to deal them in their order.
+    :return: List of (train rows, test rows).
+    """
+    if not 2 <= folds_number <= data.total_count:
+        raise ValueError('the number of folds must be between 2 and the number of rows')
+    data_rows = data.get_rows()
+    rows = list(data_rows)
+    if seed is not None:
+        random.Random(seed).shuffle(rows)
+
+    folds = []
+    for fold in range(folds_number):
+        test_rows = set(rows[fold::folds_number])
+        folds.append((array('i', (row for row in data_rows if row not in test_rows)),
+                      array('i', (row for row in data_rows if row in test_rows))))
+    return folds
+
+
+def cross_validate(data, configurations, folds_number=5, seed=None, workers=None):
+    """
+    Evaluate every configuration on every fold. The folds are views over the rows of data, nothing is copied, and
+    the configurations run in a pool of processes that read the rows from shared memory. The count table of the
+    train rows of a fold is counted once in a process and shared by NaiveBayes and the root of ID3.
+    :param data: The data object.
+    :param configurations: List of (model, parameters), see make_grid.
+    :param folds_number: The number of folds.
+    :param seed: The seed to shuffle the rows with, None to deal them in their order.
+    :param workers: The number of processes, None for the number of cpus. With one, everything runs here.
+    :return: List of results in the order of configurations, every result is a dictionary with model, parameters,
+     accuracy (the mean of the folds), fold_accuracies, train_seconds and predict_seconds (the sums of the folds).
+    """
+    for model, _ in configurations:
+        if model not in MODELS:
+            raise ValueError('unknown model %s' % model)
+    folds = make_folds(data, folds_number, seed)
+    tasks = list(product(range(len(configurations)), range(folds_number)))
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1:
+        _init_worker(None, folds, data)
+        evaluations = [_evaluate(configurations[configuration], fold) for configuration, fold in tasks]
+    else:
+        with shared_data(data) as shared, ProcessPoolExecutor(workers, initializer=_init_worker,
+                                                              initargs=(shared, folds)) as pool:
+            futures = [pool.submit(_evaluate, configurations[configuration], fold) for configuration, fold in tasks]
+            evaluations = [future.result() for future in futures]
+
+    results = [{'model': model, 'parameters': parameters, 'fold_accuracies': [], 'train_seconds': 0,
+                'predict_seconds': 0} for model, parameters in configurations]
+    for (configuration, _), (accuracy, train_seconds, predict_seconds) in zip(tasks, evaluations):
+        result = results[configuration]
+        result['fold_accuracies'].append(accuracy)
+        result['train_seconds'] += train_seconds
+        result['predict_seconds'] += predict_seconds
+    for result in results:
+        result['accuracy'] = sum(result['fold_accuracies']) / folds_number
+    return results
+
+
+def train_model(model, parameters, data, count_table=None):
+    """
+    Train a model on data.
+    :param model: The name of the model, one of MODELS.
+    :param parameters: The parameters of the model.
+    :param data: The train data, a data object or a view.
+    :param count_table: The count table of all the attributes of data, or None to count it.
+    :return: The trained model, it has predict_batch.
+    """
+    # the models of a fold are used once, their predictions are not cached
+    if model == 'ID3':
+        id3 = ID3(data, cache=None, **parameters)
+        default = max(data.class_counter.items(), key=lambda x: x[1])[0]
+        id3.generate_tree(data, data.get_all_attributes(), default, count_table=count_table)
+        return id3
+    if model == 'Knn':
+        return Knn(data, cache=None, **parameters)
+    if model == 'NaiveBayes':
+        return NaiveBayes(data, count_table, cache=None, **parameters)
+    if model == 'RandomForest':
+        # the configurations already run in a pool, the trees of a fold are trained in its process
+        return RandomForest(data, workers=1, cache=None, **parameters)
+    raise ValueError('unknown model %s' % model)
+
+
+# the state of a process of the pool, see _init_worker
+_worker_shared_memory = None
+_worker_data = None
+_worker_folds = None
+_worker_count_tables = {}  # {fold: count table of its train rows}
+
+
+def _init_worker(shared, folds, data=None):
+    """
+    Attach a process to the shared rows, or use data when everything runs in this process.
+    :param shared: The handle of the shared rows, see shared_data.
+    :param folds: The folds, see make_folds.
+    :param data: The data object, instead of the shared memory.
+    :return: None.
+    """
+    global _worker_shared_memory, _worker_data, _worker_folds, _worker_count_tables
+    if data is None:
+        _worker_shared_memory, data = attach_shared_data(shared)
+    _worker_data = data.get_source()
+    _worker_folds = folds
+    _worker_count_tables = {}
+
+
+def _evaluate(configuration, fold):
+    """
+    Train a configuration on the train rows of a fold and check its predictions of the test rows.
+    :param configuration: (model, parameters).
+    :param fold: The index of the fold.
+    :return: (accuracy, train seconds, predict seconds).
+    """
+    model, parameters = configuration
+    train_rows, test_rows = _worker_folds[fold]
+    train_data = DataView(_worker_data, train_rows)
+
+    count_table = None
+    if model in ('ID3', 'NaiveBayes'):
+        count_table = _worker_count_tables.get(fold)
+        if count_table is None:
+            count_table = _worker_count_tables[fold] = train_data.count_table(train_data.get_all_attributes())
+
+    start = time.perf_counter()
+    trained_model = train_model(model, parameters, train_data, count_table)
+    train_seconds = time.perf_counter() - start
+
+    columns = [_worker_data.get_column(attribute) for attribute in _worker_data.get_all_attributes()]
+    test_codes = [tuple(column[row] for column in columns) for row in test_rows]
+    start = time.perf_counter()
+    predictions = trained_model.predict_batch(test_codes)
+    predict_seconds = time.perf_counter() - start
+
+    class_column = _worker_data.class_column
+    class_values = _worker_data.class_values
+    success = sum(1 for prediction, row in zip(predictions, test_rows) if prediction == class_values[class_column[row]])
+    return success / len(test_rows), train_seconds, predict_seconds
+
+
+if __name__ == '__main__':
+    """
+    Cross validate some configurations of every model on train.txt and print their accuracy.
+    """
+    from data_loader import load_data
+
+    grid = (make_grid('ID3', max_depth=[None, 2, 4], min_gain=[None, 0.01]) + make_grid('Knn', k=[1, 3, 5, 7, 9]) +
+            make_grid('NaiveBayes'))
+    for cross_result in cross_validate(load_data('train.txt'), grid, folds_number=5, seed=0):
+        print('%-10s %-38s accuracy %.4f  train %.3fs  predict %.3fs' % (
+            cross_result['model'], cross_result['parameters'], cross_result['accuracy'],
+            cross_result['train_seconds'], cross_result['predict_seconds']))
@@ -0,0 +1,132 @@
+from array import array
+from itertools import repeat
+
+from data_object import DataObject
+
+CHUNK_SIZE = 1 << 22  # characters read from the file at once
+
+
+def iter_column_batches(file_path, chunk_size=CHUNK_SIZE):
+    """
+    Read a tab separated file in big chunks, the first line is the headers.
+    Only one chunk is in memory at a time, so memory does not grow with the file.
+    :param file_path: The path of the file.
+    :param chunk_size: How many characters to read at once.
+    :return: Generator of (headers, columns) for every chunk, columns has a tuple of values for every header.
+    """
+    with open(file_path, 'r') as tsv_file:
+        headers = tsv_file.readline().strip().split('\t')
+        rest = ''
+        line_number = 2  # of the first line of the next chunk, for the errors
+
+        while True:
+            chunk = tsv_file.read(chunk_size)
+            if not chunk:
+                break
+            text = rest + chunk
+            end = text.rfind('\n') + 1  # the last line may continue in the next chunk
+            text, rest = text[:end], text[end:]
+            if text.strip():
+                yield headers, _split_columns(text, len(headers), line_number)
+            line_number += text.count('\n')
+
+        if rest.strip():
+            yield headers, _split_columns(rest, len(headers), line_number)
+
+
+def _split_columns(text, columns_number, first_line=1):
+    """
+    Split full lines of tab separated values into columns.
+    :param text: The lines.
+    :param columns_number: The number of values in a line.
+    :param first_line: The number of the first line of text in the file, for the errors.
+    :return: A tuple of values for every column.
+    """
+    text = text.replace('\r\n', '\n')
+    if text.endswith('\n'):
+        text = text[:-1]
+    lines = text.split('\n')
+    if set(map(str.count, lines, repeat('\t'))) == {columns_number - 1}:
+        # every line has all the values, one split for the whole text and the values of a column are columns_number
+        # apart
+        values = text.replace('\n', '\t').split('\t')
+        return [tuple(values[i::columns_number]) for i in range(columns_number)]
+
+    # empty lines, or spaces around the values of a line, or a line with a wrong number of values, split line by line
+    rows = []
+    for line_number, line in enumerate(lines, first_line):
+        line = line.strip()
+        if line:
+            values = line.split('\t')
+            if len(values) != columns_number:
+                raise ValueError('line %d has %d values instead of %d' % (line_number, len(values), columns_number))
+            rows.append(values)
+    return list(zip(*rows))
+
+
+def load_data(file_path, chunk_size=CHUNK_SIZE):
+    """
+    Load a data object from a tab separated file, the last column is the class.
+    :param file_path: The path of the file.
+    :param chunk_size: How many characters to read at once.
+    :return: The data object.
+    """
+    data = None
+
+    for headers, columns in iter_column_batches(file_path, chunk_size):
+        if data is None:
+            data = DataObject(headers[:-1])
+        data.add_columns(columns[:-1], columns[-1])
+
+    if data is None:  # only headers in the file
+        with open(file_path, 'r') as tsv_file:
+            data = DataObject(tsv_file.readline().strip().split('\t')[:-1])
+    return data
+
+
+def encode_file(file_path, encoded_path, chunk_size=CHUNK_SIZE):
+    """
+    Encode a tab separated file into a file of codes that can be read again and again without parsing, only the
+    encoding is kept in memory. Every chunk of the file is written as the number of its rows and then the codes of
+    every column, the class last, as raw int arrays.
+    :param file_path: The path of the tab separated file, the last column is the class.
+    :param encoded_path: The path of the codes file.
+    :param chunk_size: How many characters to read at once.
+    :return: A data object with the encoding of the file and without rows.
+    """
+    data = None
+    with open(encoded_path, 'wb') as encoded_file:
+        for headers, columns in iter_column_batches(file_path, chunk_size):
+            if data is None:
+                data = DataObject(headers[:-1])
+            array('i', [len(columns[-1])]).tofile(encoded_file)
+            for attribute, column in zip(headers[:-1], columns[:-1]):
+                data.encode_column(attribute, column, add_values=True).tofile(encoded_file)
+            array('i', data.encode_classes(columns[-1], add_values=True)).tofile(encoded_file)
+
+    if data is None:  # only headers in the file
+        with open(file_path, 'r') as tsv_file:
+            data = DataObject(tsv_file.readline().strip().split('\t')[:-1])
+    return data
+
+
+def iter_encoded_chunks(encoded_path, attributes_number):
+    """
+    Read the chunks of a codes file written by encode_file, one at a time.
+    :param encoded_path: The path of the codes file.
+    :param attributes_number: The number of attributes.
+    :return: Generator of (list of the codes arrays of the attributes, codes array of the classes) for every chunk.
+    """
+    with open(encoded_path, 'rb') as encoded_file:
+        while True:
+            rows_number = array('i')
+            try:
+                rows_number.fromfile(encoded_file, 1)
+            except EOFError:
+                return
+            columns = []
+            for _ in range(attributes_number + 1):
+                column = array('i')
+                column.fromfile(encoded_file, rows_number[0])
+                columns.append(column)
+            yield columns[:-1], columns[-1]
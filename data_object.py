@@ -1,84 +1,394 @@
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+from itertools import repeat
+
+from instrumentation import instrumentation
+
+
+def most_common_class(class_counter):
+    """
+    Return the most common class of a classes counter.
+    :param class_counter: {class: count}.
+    :return: The most common class.
+    """
+    # part of the exercise requirements, to choose yes and 1 over no and 0 in case of equality
+    if len(class_counter.keys()) == 2:
+        values = list(class_counter.values())
+        if values[0] == values[1]:
+            return sorted(class_counter.keys())[1]
+    return max(class_counter.items(), key=lambda x: x[1])[0]
+
+
 class DataObject(object):
 
-    def __init__(self):
+    def __init__(self, attributes_names=None):
         """
         Construct a data object for prediction. or training
+        The rows are kept column by column: every attribute has a compact array of integer codes, and the code of
+        a value is its index in dict_of_attributes[attribute].
+        :param attributes_names: The attributes names, if None they are taken from the first added entry.
         """
-        self.entries = []
+        self.attributes_names = []
+        self.attributes_indexes = {}  # {attribute: index of its column}
+        self.columns = []  # [array of codes of attribute 1, array of codes of attribute 2...]
+        self.value_codes = []  # [{value1: code1, value2: code2..}, ...] the reverse of dict_of_attributes
+        self.class_column = array('i')
+        self.class_codes = {}  # {'class1': code1, 'class2': code2...}
+        self.class_values = []  # [class of code 0, class of code 1...]
         self.dict_of_attributes = {}
 
         self.attributes_counter = {}
         self.class_counter = {}  # {'class1: counter1, class 2: counter2...}
         self.total_count = 0
 
+        if attributes_names is not None:
+            self._set_attributes_names(attributes_names)
+
+    def _set_attributes_names(self, attributes_names):
+        """
+        Define the attributes of the data and create an empty column for each one of them.
+        :param attributes_names: The attributes names.
+        :return: None.
+        """
+        self.attributes_names = list(attributes_names)
+        self.attributes_indexes = {name: i for i, name in enumerate(self.attributes_names)}
+        self.columns = [array('i') for _ in self.attributes_names]
+        self.value_codes = [{} for _ in self.attributes_names]
+
     def add_entry(self, entry):
         """
         Adding the entry to the data.
         :param entry: The entry to add.
         :return: None.
         """
-        self.entries.append(entry)
-        self._add_attributes_of_entry(entry)
-        self._count_attributes(entry)
+        if not self.attributes_names:
+            self._set_attributes_names(entry.attributes_names[:len(entry.attributes)])
+        self.add_row(entry.attributes, entry.entry_class)
+
+    def add_row(self, values, entry_class):
+        """
+        Adding a row of raw values to the data, without building an entry for it.
+        :param values: The values of the attributes, in the order of attributes_names.
+        :param entry_class: The class of the row.
+        :return: None.
+        """
+        for attribute_index, value in enumerate(values):
+            codes = self.value_codes[attribute_index]
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(codes)
+                self.dict_of_attributes.setdefault(self.attributes_names[attribute_index], []).append(value)
+            self.columns[attribute_index].append(code)
+        self._count_attributes(values)
 
-        if entry.entry_class in self.class_counter:
-            self.class_counter[entry.entry_class] += 1
+        class_code = self.class_codes.get(entry_class)
+        if class_code is None:
+            class_code = self.class_codes[entry_class] = len(self.class_values)
+            self.class_values.append(entry_class)
+        self.class_column.append(class_code)
+
+        if entry_class in self.class_counter:
+            self.class_counter[entry_class] += 1
         else:
-            self.class_counter[entry.entry_class] = 1
+            self.class_counter[entry_class] = 1
 
         self.total_count += 1
 
+    def add_columns(self, columns, classes):
+        """
+        Adding a batch of rows given column by column, the values are encoded a column at a time.
+        :param columns: A sequence of values for every attribute, in the order of attributes_names.
+        :param classes: The classes of the rows.
+        :return: None.
+        """
+        for attribute_index, column in enumerate(columns):
+            attribute_name = self.attributes_names[attribute_index]
+            codes = self.value_codes[attribute_index]
+            counter = self.attributes_counter.setdefault(attribute_name, {})
+            # Counter keeps the order in which the values first appear
+            for value, count in Counter(column).items():
+                if value not in codes:
+                    codes[value] = len(codes)
+                    self.dict_of_attributes.setdefault(attribute_name, []).append(value)
+                counter[value] = counter.get(value, 0) + count
+            self.columns[attribute_index].extend(map(codes.__getitem__, column))
+
+        for class_type, count in Counter(classes).items():
+            if class_type not in self.class_codes:
+                self.class_codes[class_type] = len(self.class_values)
+                self.class_values.append(class_type)
+            self.class_counter[class_type] = self.class_counter.get(class_type, 0) + count
+        self.class_column.extend(map(self.class_codes.__getitem__, classes))
+
+        self.total_count += len(classes)
+
+    def get_entry(self, row):
+        """
+        Build the entry of a row.
+        :param row: The index of the row.
+        :return: The entry.
+        """
+        values = [self.dict_of_attributes[attribute][column[row]]
+                  for attribute, column in zip(self.attributes_names, self.columns)]
+        return Entry(self.attributes_names, *values, self.class_values[self.class_column[row]])
+
     def get_all_entries(self):
         """
-        Return the entries.
+        Return the entries, built on demand from the columns.
         :return: The entries.
         """
-        return self.entries
+        return [self.get_entry(row) for row in range(self.total_count)]
 
     def get_all_attributes(self):
         """
         Return all the attributes.
         :return: All the attributes.
         """
-        return self.entries[0].attributes_names
+        return self.attributes_names
+
+    def get_column(self, attribute):
+        """
+        Return the codes of an attribute for all the rows.
+        :param attribute: given attribute.
+        :return: Array of codes.
+        """
+        return self.columns[self.attributes_indexes[attribute]]
+
+    def encode_value(self, attribute, value):
+        """
+        Return the code of value in attribute.
+        :param attribute: given attribute.
+        :param value: given value.
+        :return: The code, or -1 if the value was never seen.
+        """
+        return self.value_codes[self.attributes_indexes[attribute]].get(value, -1)
+
+    def encode_entry(self, entry):
+        """
+        Return the codes of an entry, in the order of attributes_names.
+        :param entry: given entry, it may come with its attributes in a different order.
+        :return: Tuple of codes, -1 for values that were never seen.
+        """
+        values = dict(zip(entry.attributes_names, entry.attributes))
+        return tuple(codes.get(values.get(attribute), -1)
+                     for attribute, codes in zip(self.attributes_names, self.value_codes))
+
+    def encode_rows(self, attributes_names, rows):
+        """
+        Encode many rows of raw values at once, an encoded matrix for the batch predictions.
+        :param attributes_names: The attributes of the values in rows, they may come in a different order.
+        :param rows: List of lists of values.
+        :return: List of codes tuples in the order of attributes_names of the data, -1 for values that were never seen.
+        """
+        if not rows:
+            return []
+        return self.encode_columns(attributes_names, list(zip(*rows)))
 
-    def _add_attributes_of_entry(self, entry):
+    def encode_columns(self, attributes_names, columns, add_values=False):
         """
-        Adding entry's attributes to the dictionary.
-        :param entry: given entry.
-        :return: None
+        Encode a batch of rows given column by column.
+        :param attributes_names: The attributes of the columns, they may come in a different order.
+        :param columns: A sequence of values for every attribute in attributes_names.
+        :param add_values: True to give codes to values that were never seen, without adding rows to the data.
+        :return: List of codes tuples in the order of attributes_names of the data, -1 for values that were never seen.
         """
-        for attribute, value in zip(entry.attributes_names, entry.attributes):
-            if attribute in self.dict_of_attributes:
-                if value not in self.dict_of_attributes[attribute]:
-                    self.dict_of_attributes[attribute].append(value)
+        positions = {attribute: i for i, attribute in enumerate(attributes_names)}
+        rows_number = len(columns[0]) if columns else 0
+        encoded_columns = []
+
+        for attribute, codes in zip(self.attributes_names, self.value_codes):
+            if attribute in positions:
+                column = columns[positions[attribute]]
+                if add_values:
+                    self._add_values(attribute, column)
+                encoded_columns.append(map(codes.get, column, repeat(-1)))
             else:
-                self.dict_of_attributes[attribute] = [value]
+                encoded_columns.append(repeat(-1, rows_number))
+
+        return list(zip(*encoded_columns))
+
+    def encode_column(self, attribute, values, add_values=False):
+        """
+        Encode the values of one attribute.
+        :param attribute: The attribute.
+        :param values: The values.
+        :param add_values: True to give codes to values that were never seen, without adding rows to the data.
+        :return: Array of the codes, -1 for values that were never seen.
+        """
+        if add_values:
+            self._add_values(attribute, values)
+        return array('i', map(self.value_codes[self.attributes_indexes[attribute]].get, values, repeat(-1)))
+
+    def encode_classes(self, classes, add_values=False):
+        """
+        Encode classes.
+        :param classes: The classes.
+        :param add_values: True to give codes to classes that were never seen, without adding rows to the data.
+        :return: List of class codes, -1 for classes that were never seen.
+        """
+        if add_values:
+            for class_type in dict.fromkeys(classes):
+                if class_type not in self.class_codes:
+                    self.class_codes[class_type] = len(self.class_values)
+                    self.class_values.append(class_type)
+        return list(map(self.class_codes.get, classes, repeat(-1)))
+
+    def _add_values(self, attribute, values):
+        """
+        Give codes to the values of attribute that were never seen, in the order they first appear.
+        :param attribute: The attribute.
+        :param values: The values.
+        :return: None.
+        """
+        codes = self.value_codes[self.attributes_indexes[attribute]]
+        for value in dict.fromkeys(values):
+            if value not in codes:
+                codes[value] = len(codes)
+                self.dict_of_attributes.setdefault(attribute, []).append(value)
+
+    def get_encoding(self):
+        """
+        Return what is needed to encode values like this data: the attributes, their values and the classes.
+        :return: Dictionary of the encoding, see from_encoding.
+        """
+        source = self.get_source()
+        return {'attributes_names': source.attributes_names, 'dict_of_attributes': source.dict_of_attributes,
+                'class_values': source.class_values}
+
+    @staticmethod
+    def from_encoding(encoding):
+        """
+        Build an empty data object that encodes values like the data the encoding came from.
+        :param encoding: The encoding, see get_encoding.
+        :return: The data object.
+        """
+        data = DataObject(encoding['attributes_names'])
+        for attribute, codes in zip(data.attributes_names, data.value_codes):
+            data.dict_of_attributes[attribute] = list(encoding['dict_of_attributes'][attribute])
+            codes.update((value, code) for code, value in enumerate(data.dict_of_attributes[attribute]))
+        data.class_values = list(encoding['class_values'])
+        data.class_codes = {class_type: code for code, class_type in enumerate(data.class_values)}
+        return data
+
+    def copy_encoding(self):
+        """
+        Copy the encoding into a data object without rows, so a model keeps the encoding it was built with: values
+        added later to the encoding of either one do not reach the other.
+        :return: The data object.
+        """
+        return DataObject.from_encoding(self.get_encoding())
+
+    def to_shared_memory(self):
+        """
+        Copy the columns of the data into one shared memory block, so other processes can read them without pickling.
+        The caller owns the block and must close and unlink it.
+        :return: The shared memory block and a description of the data to give to from_shared_memory.
+        """
+        from multiprocessing.shared_memory import SharedMemory  # python 3.8, only the parallel paths need it
+
+        source = self.get_source()
+        item_size = source.class_column.itemsize
+        size = (len(source.columns) + 1) * source.total_count * item_size
+        shared_memory = SharedMemory(create=True, size=max(item_size, size))
+        buffer = shared_memory.buf.cast('i')
+        for i, column in enumerate(source.columns + [source.class_column]):
+            buffer[i * source.total_count:(i + 1) * source.total_count] = column
+        buffer.release()
+
+        description = {'encoding': source.get_encoding(), 'attributes_counter': source.attributes_counter,
+                       'class_counter': source.class_counter, 'total_count': source.total_count}
+        return shared_memory, description
+
+    @staticmethod
+    def from_shared_memory(shared_memory, description):
+        """
+        Build a read only data object over columns in a shared memory block, see to_shared_memory.
+        :param shared_memory: The shared memory block.
+        :param description: The description of the data.
+        :return: The data object, its columns are memory views of the block.
+        """
+        data = DataObject.from_encoding(description['encoding'])
+        total_count = description['total_count']
+        buffer = shared_memory.buf.cast('i')
+        data.columns = [buffer[i * total_count:(i + 1) * total_count] for i in range(len(data.attributes_names) + 1)]
+        data.class_column = data.columns.pop()
+        data.attributes_counter = description['attributes_counter']
+        data.class_counter = description['class_counter']
+        data.total_count = total_count
+        return data
 
     def most_common_class(self):
         """
         Return the most common class.
         :return: The most common class.
         """
-        # part of the exercise requirements, to choose yes and 1 over no and 0 in case of equality
-        if len(self.class_counter.keys()) == 2:
-            values = list(self.class_counter.values())
-            if values[0] == values[1]:
-                return sorted(self.class_counter.keys())[1]
-        return max(self.class_counter.items(), key=lambda x: x[1])[0]
+        return most_common_class(self.class_counter)
+
+    def get_source(self):
+        """
+        Return the data object that really holds the rows.
+        :return: The data object itself.
+        """
+        return self
+
+    def get_rows(self):
+        """
+        Return the indexes of the rows of the data in the source data object.
+        :return: The indexes of the rows.
+        """
+        return range(self.total_count)
 
     def get_data_with_attribute_choice(self, attribute, value):
         """
         Return the data only with attribute as value.
         :param attribute: given attribute.
         :param value: given value.
-        :return: New data with only these properties.
+        :return: A view over the rows with these properties, the rows are not copied.
+        """
+        source = self.get_source()
+        code = source.encode_value(attribute, value)
+        column = source.get_column(attribute)
+        return DataView(source, array('i', (row for row in self.get_rows() if column[row] == code)))
+
+    def split(self, attribute):
+        """
+        Split the data by the values of attribute in one pass over the rows.
+        :param attribute: given attribute.
+        :return: {value: view over the rows with that value} for all the values of attribute in the source data,
+         values without rows get an empty view.
         """
-        new_data = DataObject()
-        for entry in self.entries:
-            if entry.has_attribute(attribute, value):
-                new_data.add_entry(entry)
-        return new_data
+        if instrumentation.enabled:
+            instrumentation.count('data.split_rows', self.total_count)
+        source = self.get_source()
+        column = source.get_column(attribute)
+        partitions = [array('i') for _ in source.dict_of_attributes[attribute]]
+        for row in self.get_rows():
+            partitions[column[row]].append(row)
+        return {value: DataView(source, rows) for value, rows in zip(source.dict_of_attributes[attribute], partitions)}
+
+    def count_table(self, attributes):
+        """
+        Count the classes of every value of the attributes, a contingency table like:
+         {pclass: {code of 1st: [count of class code 0, count of class code 1..], ..}, sex: {...}}.
+        Only values that appear in the data are in the table, in the order they first appear.
+        :param attributes: The attributes to count.
+        :return: The count table.
+        """
+        if instrumentation.enabled:
+            instrumentation.count('data.count_table_cells', self.total_count * len(attributes))
+        classes_number = len(self.class_values)
+        class_column = self.class_column
+        table = {}
+
+        for attribute in attributes:
+            attribute_table = table[attribute] = {}
+            for (code, class_code), count in Counter(zip(self.get_column(attribute), class_column)).items():
+                if code not in attribute_table:
+                    attribute_table[code] = [0] * classes_number
+                attribute_table[code][class_code] = count
+
+        return table
 
     def get_all_classes(self):
         """
@@ -87,15 +397,15 @@ class DataObject(object):
         """
         return [name for name, occ in self.class_counter.items() if occ != 0]
 
-    def _count_attributes(self, entry):
+    def _count_attributes(self, values):
         """
-        Count all the attributes in entry. Making a counter dictionary like:
+        Count all the attributes values of a row. Making a counter dictionary like:
          {pclass: {1st: 34, ..}, sex:{male: 3...}}.
-        :param entry: given entry.
+        :param values: The values of the row.
         :return: None.
         """
-        for attribute_index, value in enumerate(entry.attributes):
-            attribute_name = entry.attributes_names[attribute_index]
+        for attribute_index, value in enumerate(values):
+            attribute_name = self.attributes_names[attribute_index]
 
             if attribute_name in self.attributes_counter:
                 if value in self.attributes_counter[attribute_name]:
@@ -106,6 +416,107 @@ class DataObject(object):
                 self.attributes_counter[attribute_name] = {value: 1}
 
 
+class DataView(DataObject):
+
+    def __init__(self, data, rows=None):
+        """
+        Construct a read only view over some of the rows of a data object, without copying them.
+        The counters of the view are calculated only when they are first needed.
+        :param data: The data object that holds the rows.
+        :param rows: Array of the indexes of the rows in data, None for all the rows.
+        """
+        self.data = data
+        self.rows = rows if rows is not None else array('i', range(data.total_count))
+        self.total_count = len(self.rows)
+        self.attributes_names = data.attributes_names
+        self.attributes_indexes = data.attributes_indexes
+        self.value_codes = data.value_codes
+        self.class_codes = data.class_codes
+        self.class_values = data.class_values
+        self._class_counter = None
+        self._attributes_counter = None
+
+    def add_row(self, values, entry_class):
+        """
+        A view is read only, add rows to the data object instead.
+        """
+        raise TypeError('can not add rows to a data view')
+
+    def add_columns(self, columns, classes):
+        """
+        A view is read only, add rows to the data object instead.
+        """
+        raise TypeError('can not add rows to a data view')
+
+    def get_source(self):
+        """
+        Return the data object that really holds the rows.
+        :return: The data object of the view.
+        """
+        return self.data
+
+    def get_rows(self):
+        """
+        Return the indexes of the rows of the view in the source data object.
+        :return: The indexes of the rows.
+        """
+        return self.rows
+
+    def get_entry(self, row):
+        """
+        Build the entry of a row of the view.
+        :param row: The index of the row in the view.
+        :return: The entry.
+        """
+        return self.data.get_entry(self.rows[row])
+
+    def get_column(self, attribute):
+        """
+        Return the codes of an attribute for the rows of the view.
+        :param attribute: given attribute.
+        :return: Array of codes.
+        """
+        return array('i', map(self.data.get_column(attribute).__getitem__, self.rows))
+
+    @property
+    def class_column(self):
+        """
+        The class codes of the rows of the view.
+        """
+        return array('i', map(self.data.class_column.__getitem__, self.rows))
+
+    @property
+    def class_counter(self):
+        """
+        The classes counter of the view.
+        """
+        if self._class_counter is None:
+            # Counter keeps the order in which the classes first appear, like a data object does
+            self._class_counter = {self.class_values[code]: count for code, count in Counter(self.class_column).items()}
+        return self._class_counter
+
+    @property
+    def attributes_counter(self):
+        """
+        The attributes values counter of the view.
+        """
+        if self._attributes_counter is None:
+            self._attributes_counter = {}
+            if self.total_count != 0:
+                for attribute in self.attributes_names:
+                    values = self.data.dict_of_attributes[attribute]
+                    codes_counter = Counter(self.get_column(attribute))
+                    self._attributes_counter[attribute] = {values[code]: count for code, count in codes_counter.items()}
+        return self._attributes_counter
+
+    @property
+    def dict_of_attributes(self):
+        """
+        The attributes values that appear in the view.
+        """
+        return {attribute: list(counter) for attribute, counter in self.attributes_counter.items()}
+
+
 class Entry(object):
 
     def __init__(self, attributes_names, *attributes):
@@ -163,3 +574,32 @@ class Entry(object):
         :return: String of entry.
         """
         return '%s %s' % (str(self.attributes), self.entry_class)
+
+
+@contextmanager
+def shared_data(data):
+    """
+    Copy the rows of the source of data into a shared memory block for the processes of a pool, the block is closed
+    and unlinked when the with block ends: with shared_data(data) as shared: ... attach_shared_data(shared) ...
+    :param data: The data object or a view.
+    :return: Context manager of the handle to give to attach_shared_data in the processes.
+    """
+    shared_memory, description = data.get_source().to_shared_memory()
+    try:
+        yield shared_memory.name, description
+    finally:
+        shared_memory.close()
+        shared_memory.unlink()
+
+
+def attach_shared_data(shared):
+    """
+    Attach a process to the rows of shared_data.
+    :param shared: The handle of shared_data.
+    :return: The shared memory block and the read only data object over it, keep the block while the data is used.
+    """
+    from multiprocessing.shared_memory import SharedMemory  # python 3.8, see DataObject.to_shared_memory
+
+    shared_memory_name, description = shared
+    shared_memory = SharedMemory(shared_memory_name)
+    return shared_memory, DataObject.from_shared_memory(shared_memory, description)
@@ -1,6 +1,18 @@
+import heapq
+import os
+import random
+import tempfile
+from array import array
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor
 from math import log
 
-from attribute_node import AttributeNode, ClassNode
+from attribute_node import AttributeNode, ClassNode, CompiledTree, NodeSummary
+from data_loader import CHUNK_SIZE, encode_file, iter_encoded_chunks
+from data_object import DataObject, DataView, attach_shared_data, most_common_class, shared_data
+from instrumentation import instrumentation
+from model_io import read_model, write_model
+from prediction_cache import next_model_id, shared_cache
 
 
 def check_for_consolidation(root):
@@ -24,14 +36,48 @@ def check_for_consolidation(root):
 
 class ID3(object):
 
-    def __init__(self, data, log_base=2):
+    def __init__(self, data, log_base=2, parallel_depth=1, parallel_min_rows=1000, incremental=False, max_depth=None,
+                 min_samples_split=2, min_gain=None, consolidate=False, max_features=None, seed=None,
+                 cache=shared_cache):
         """
         Construct ID3 object using a given log base, usually it's 2. Also define the tree as None.
+        The limits stop the tree early, a node that reaches one of them becomes a leaf of its most common class.
         :param log_base: The logarithm base for the calculation of the probability.
+        :param parallel_depth: In a parallel build, the depth from which subtrees are sent to other processes.
+        :param parallel_min_rows: In a parallel build, subtrees with less rows are built in this process.
+        :param incremental: True to keep counts in the nodes of the tree, so it can be updated with partial_fit.
+        :param max_depth: The maximal depth of an attribute node, None for no limit.
+        :param min_samples_split: The minimal number of rows of an attribute node.
+        :param min_gain: The minimal gain of the attribute of a node, None for no limit.
+        :param consolidate: True to replace nodes whose children are all leaves of one class by that leaf, see
+         check_for_consolidation.
+        :param max_features: The number of attributes drawn at random for every node, the best of them is chosen.
+         None to choose from all the attributes, like a single tree does. A random forest uses fewer.
+        :param seed: The seed of the random draws of the attributes.
+        :param cache: The prediction cache of predict and predict_codes, None to not cache the predictions.
         """
+        if incremental and consolidate:
+            raise ValueError('an incremental tree can not be consolidated')
+        if incremental and max_features is not None:
+            raise ValueError('an incremental tree can not draw attributes at random')
         self.log_base = log_base
+        self.incremental = incremental
+        self.max_depth = max_depth
+        self.min_samples_split = min_samples_split
+        self.min_gain = min_gain
+        self.consolidate = consolidate
+        self.max_features = max_features
+        self.seed = seed
+        self._random = random.Random(seed)
+        self.parallel_depth = parallel_depth
+        self.parallel_min_rows = parallel_min_rows
         self.data = data
         self.tree = None
+        self.compiled_tree = None
+        self.compiled_encoding = None  # the encoding of the data when the tree was compiled
+        self.cache = cache
+        self.model_id = next_model_id()
+        self.version = 0  # changes with the tree, so the cache does not return predictions of an old tree
 
     def predict(self, entry):
         """
@@ -39,109 +85,437 @@ class ID3(object):
         :param entry: Entry to predict.
         :return: Decision tree for that entry.
         """
-        return self.tree.predict(entry)
+        return self.predict_codes(self.data.encode_entry(entry))
 
-    def generate_tree(self, data, attributes, default=None):
+    def predict_codes(self, codes):
+        """
+        Predict the class for encoded values with the compiled tree, repeated queries are answered from the cache.
+        :param codes: The codes of the values, -1 for a value the data never had.
+        :return: The prediction.
+        """
+        if self.cache is None:
+            return self.compile().predict_codes(codes)
+        return self.cache.predict(self, tuple(codes), self.compile().predict_codes)
+
+    def predict_batch(self, rows):
+        """
+        Predict many encoded rows with the compiled tree.
+        :param rows: Codes tuples in the order of the attributes of self.data, see DataObject.encode_rows.
+        :return: List of the predictions.
+        """
+        return self.compile().predict_batch(rows)
+
+    def compile(self):
+        """
+        Flatten the current tree into arrays for fast prediction, the result is kept until the tree changes.
+        :return: The compiled tree.
+        """
+        if self.compiled_tree is None or self.compiled_tree.root is not self.tree:
+            with instrumentation.timer('id3.compile'):
+                self.compiled_tree = CompiledTree(self.tree, self.data)
+                self.compiled_encoding = self.data.copy_encoding()
+        return self.compiled_tree
+
+    def save(self, file_path):
+        """
+        Save the compiled tree in a binary model file, with the encoding it was compiled with.
+        :param file_path: The path of the file.
+        :return: None.
+        """
+        compiled_tree = self.compile()
+        header = {'encoding': self.compiled_encoding.get_encoding(), 'classes': compiled_tree.classes,
+                  'log_base': self.log_base}
+        write_model(file_path, 'ID3', header, compiled_tree.get_arrays())
+
+    @staticmethod
+    def load(file_path):
+        """
+        Load an ID3 saved by save, the arrays of the tree are memory mapped. It can predict but it has no data rows
+        and no object tree.
+        :param file_path: The path of the file.
+        :return: The ID3.
+        """
+        header, arrays = read_model(file_path, 'ID3')
+        id3 = ID3(DataObject.from_encoding(header['encoding']), header['log_base'])
+        id3.compiled_tree = CompiledTree.from_arrays(header['classes'], arrays)
+        id3.compiled_encoding = id3.data
+        return id3
+
+    def generate_tree_parallel(self, data, attributes, default=None, workers=None):
+        """
+        Generate the same decision tree as generate_tree, building the subtrees below parallel_depth with at least
+        parallel_min_rows rows in a pool of processes. The processes read the rows from shared memory.
+        :param data: The data we have as training examples.
+        :param attributes: The attributes of the data.
+        :param default: The default class in case of tie.
+        :param workers: The number of processes, None for the number of cpus.
+        :return: The decision tree for data.
+        """
+        with shared_data(data) as shared, ProcessPoolExecutor(workers, initializer=_init_worker,
+                                                              initargs=(shared, self.get_options())) as pool:
+            root = _resolve_futures(self.generate_tree(data, attributes, default, pool=pool), self.consolidate)
+
+        self.tree = root
+        return root
+
+    def generate_tree_out_of_core(self, file_path, default=None, chunk_size=CHUNK_SIZE, temp_dir=None):
+        """
+        Generate the same decision tree as generate_tree on a tab separated file that does not fit in memory.
+        The file is encoded once into a temporary file of codes, then the tree grows breadth first: one sequential
+        pass over the codes per level routes every row to its node of the level and counts the count tables of all
+        the nodes of the level at once. The node of every row is kept in another temporary file, so the memory is the
+        count tables of a level (nodes * values * classes) and one chunk, whatever the number of rows.
+        Afterwards self.data holds the encoding of the file and no rows, it can predict and save but not partial_fit.
+        :param file_path: The path of the tab separated file, the last column is the class.
+        :param default: The default class in case of tie.
+        :param chunk_size: How many characters of the file to read at once, the codes are read in the same chunks.
+        :param temp_dir: The directory of the temporary files, None for the default of tempfile.
+        :return: The decision tree for the file.
+        """
+        if self.incremental:
+            raise ValueError('an incremental tree needs its rows in memory')
+        with tempfile.TemporaryDirectory(dir=temp_dir) as directory:
+            codes_path = os.path.join(directory, 'codes')
+            nodes_path = os.path.join(directory, 'nodes')
+            self.data = data = encode_file(file_path, codes_path, chunk_size)
+
+            holder = {}  # the parent of the root
+            # the nodes of the level: (attributes, default, depth, children of the parent, value in the parent)
+            frontier = [(data.get_all_attributes(), default, 0, holder, None)]
+            routes = None  # for every node of the previous level, None or (attribute index, child by code)
+            while frontier:
+                class_counters, tables = _count_level(data, codes_path, nodes_path, routes, len(frontier))
+                next_frontier = []
+                routes = []
+                for (attributes, node_default, depth, parent, value), class_counter, table in zip(
+                        frontier, class_counters, tables):
+                    count_table = {attribute: table[data.attributes_indexes[attribute]] for attribute in attributes}
+                    node, route = self._grow_node(data, class_counter, count_table, attributes, node_default, depth,
+                                                  next_frontier)
+                    parent[value] = node
+                    routes.append(route)
+                frontier = next_frontier
+
+        root = holder[None]
+        if self.consolidate:
+            root = _resolve_futures(root, True)
+        self.tree = root
+        self.compiled_tree = None
+        return root
+
+    def _grow_node(self, data, class_counter, count_table, attributes, default, depth, frontier):
+        """
+        Decide a node of an out of core build from its counts, like generate_tree decides from its rows. The children
+        that need more counts are added to the next level, the others are made here.
+        :param data: The data object with the encoding.
+        :param class_counter: The classes counter of the rows of the node.
+        :param count_table: The count table of attributes on the rows of the node.
+        :param attributes: The attributes left for the node.
+        :param default: The default class in case of tie.
+        :param depth: The depth of the node.
+        :param frontier: The nodes of the next level, the children of the node are appended to it.
+        :return: (the node, None or (index of its attribute, the index of the child in frontier by code, or -1)).
+        """
+        self.version += 1
+        if instrumentation.enabled:
+            instrumentation.count('id3.nodes')
+        total_count = sum(class_counter.values())
+        if total_count == 0:
+            return ClassNode(default), None
+        if len(class_counter) == 1:
+            return ClassNode(next(iter(class_counter))), None
+        if (len(attributes) == 0 or (self.max_depth is not None and depth >= self.max_depth)
+                or total_count < self.min_samples_split):
+            return ClassNode(most_common_class(class_counter)), None
+
+        best_attribute, best_gain = self._choose_attribute(class_counter, total_count, count_table,
+                                                           self._draw_attributes(attributes))
+        if self.min_gain is not None and best_gain < self.min_gain:
+            return ClassNode(most_common_class(class_counter)), None
+        new_default = max(class_counter.items(), key=lambda x: x[1])[0]
+        node = AttributeNode(best_attribute, default=new_default)
+        new_attributes = [x for x in attributes if x != best_attribute]
+        attribute_table = count_table[best_attribute]
+        children = array('i', [-1]) * len(data.dict_of_attributes[best_attribute])
+
+        for code, value in enumerate(data.dict_of_attributes[best_attribute]):
+            class_counts = attribute_table.get(code)
+            classes = [class_code for class_code, count in enumerate(class_counts or ()) if count != 0]
+            if len(classes) > 1:
+                node.add_child_to_dict(value, None)  # keeps the order of the values, set by the next level
+                children[code] = len(frontier)
+                frontier.append((new_attributes, new_default, depth + 1, node.dict, value))
+                continue
+            # no rows or one class, the child is a leaf without another pass
+            if instrumentation.enabled:
+                instrumentation.count('id3.nodes')
+            node.add_child_to_dict(value, ClassNode(data.class_values[classes[0]] if classes else new_default))
+
+        return node, (data.attributes_indexes[best_attribute], children)
+
+    def get_options(self):
+        """
+        Return the options of the tree building, to construct the same ID3 on other data.
+        :return: The keyword arguments of the constructor, without the data.
+        """
+        return {'log_base': self.log_base, 'incremental': self.incremental, 'max_depth': self.max_depth,
+                'min_samples_split': self.min_samples_split, 'min_gain': self.min_gain,
+                'consolidate': self.consolidate, 'max_features': self.max_features, 'seed': self.seed}
+
+    def generate_tree(self, data, attributes, default=None, depth=0, pool=None, count_table=None):
         """
         Generate the decision tree for a given data.
         :param data: The data we have as training examples.
         :param attributes: The attributes of the data.
         :param default: The default class in case of tie.
+        :param depth: The depth of the tree we generate.
+        :param pool: Process pool for big subtrees, see generate_tree_parallel. The tree may then hold futures.
+        :param count_table: The count table of attributes on data if it was already counted, see
+         DataObject.count_table. An incremental tree keeps and updates it.
         :return: The decision tree for data.
         """
+        self.version += 1
+        if instrumentation.enabled:
+            instrumentation.count('id3.nodes')
         # if we got no data left, return the default value
         if data.total_count == 0:
-            return ClassNode(default)
+            return self._make_leaf(default, data, attributes, default)
 
         # if all the classes are the same, return a terminal node
         data_classes = data.get_all_classes()
         if len(data_classes) == 1:
-            return ClassNode(data_classes.pop())
+            return self._make_leaf(data_classes.pop(), data, attributes, default)
 
         # if there is only one attribute left, choose the more common class
         if len(attributes) == 0:
-            return ClassNode(data.most_common_class())
-
-        # calc entropy for all attributes
-        entropy_dict = {}
-        decision_entropy = self.calc_decision_entropy(data)
+            return self._make_leaf(data.most_common_class(), data, attributes, default)
 
-        for attribute in attributes:
-            entropy_dict[attribute] = self.calc_gain(decision_entropy, attribute, data)
+        # stop early when the node reached a limit
+        if (self.max_depth is not None and depth >= self.max_depth) or data.total_count < self.min_samples_split:
+            return self._make_leaf(data.most_common_class(), data, attributes, default)
 
-        best_attribute = max(entropy_dict.items(), key=lambda x: x[1])[0]
-        root = AttributeNode(best_attribute)
-        best_attribute_options = self.data.dict_of_attributes[best_attribute]
-
-        for choice in best_attribute_options:
-            data_with_attribute = data.get_data_with_attribute_choice(best_attribute, choice)
+        # calc entropy for all attributes, or for those drawn for the node
+        candidates = self._draw_attributes(attributes)
+        if count_table is None:
+            count_table = data.count_table(candidates)
+        best_attribute, best_gain = self._choose_attribute(data.class_counter, data.total_count, count_table,
+                                                           candidates)
+        if self.min_gain is not None and best_gain < self.min_gain:
+            return self._make_leaf(data.most_common_class(), data, attributes, default)
+        new_default = max(data.class_counter.items(), key=lambda x: x[1])[0]
+        root = AttributeNode(best_attribute, default=new_default)
+        if self.incremental:
+            root.summary = NodeSummary(attributes, default, dict(data.class_counter), count_table)
+        # the views of the branches share the rows of self.data, nothing is copied
+        for choice, data_with_attribute in data.split(best_attribute).items():
             new_attributes = [x for x in attributes if x != best_attribute]
-            new_default = max(data.class_counter.items(), key=lambda x: x[1])[0]
 
-            child = self.generate_tree(data_with_attribute, new_attributes, default=new_default)
+            if (pool is not None and depth + 1 >= self.parallel_depth
+                    and data_with_attribute.total_count >= self.parallel_min_rows):
+                child = pool.submit(_generate_subtree, data_with_attribute.get_rows(), new_attributes, new_default,
+                                    depth + 1)
+            else:
+                child = self.generate_tree(data_with_attribute, new_attributes, new_default, depth + 1, pool)
             root.add_child_to_dict(choice, child)
 
         # in the exercise we didn't need to, but I made consolidate function
-        # root = check_for_consolidation(root)
+        if self.consolidate:
+            root = check_for_consolidation(root)
         self.tree = root
         return root
 
-    def calc_gain(self, decision_entropy, attribute, data):
+    def _make_leaf(self, class_name, data, attributes, default):
+        """
+        Make a class node, with its counts and rows when the tree is incremental.
+        :param class_name: The class of the node.
+        :param data: The rows of the node.
+        :param attributes: The attributes left for the node.
+        :param default: The default class the node got.
+        :return: The class node.
+        """
+        leaf = ClassNode(class_name)
+        if self.incremental:
+            leaf.summary = NodeSummary(attributes, default, dict(data.class_counter), rows=array('i', data.get_rows()))
+        self.tree = leaf
+        return leaf
+
+    def partial_fit(self, rows):
+        """
+        Add new rows to self.data and update the tree incrementally, in the spirit of ID5R: the counts are updated along
+        the paths of the rows, and only subtrees whose best attribute changed are generated again from their rows.
+        The result is the tree generate_tree would build on all the rows. The tree must be generated with incremental.
+        :param rows: Lists of values in the order of the attributes of self.data, with the class last.
+        :return: The updated tree.
+        """
+        if self.tree is None or self.tree.summary is None:
+            raise ValueError('the tree was not generated by an incremental ID3')
+        if self.data.get_source() is not self.data:
+            # checked before anything changes, the rows of a view can not grow
+            raise TypeError('can not add rows to a tree of a data view, generate it on a data object')
+        if not rows:
+            return self.tree
+
+        first_row = self.data.total_count
+        values_numbers = {attribute: len(values) for attribute, values in self.data.dict_of_attributes.items()}
+        columns = list(zip(*rows))
+        classes = columns.pop()
+        self.data.add_columns(columns, classes)
+        new_rows = DataView(self.data, array('i', range(first_row, self.data.total_count)))
+        # every node that splits on an attribute with new values needs children for them
+        grown_attributes = {attribute for attribute, values in self.data.dict_of_attributes.items()
+                            if len(values) != values_numbers.get(attribute, 0)}
+
+        self.version += 1
+        summary = self.tree.summary
+        self.tree = self._update_node(self.tree, new_rows, summary.attributes, summary.default, grown_attributes, 0)
+        self.compiled_tree = None
+        return self.tree
+
+    def _update_node(self, node, new_rows, attributes, default, grown_attributes, depth):
+        """
+        Update a subtree with new rows.
+        :param node: The root of the subtree, with its summary.
+        :param new_rows: View of the new rows that reach the node, they come after all the rows of the node.
+        :param attributes: The attributes left for the node.
+        :param default: The default class the node gets from its parent.
+        :param grown_attributes: The attributes that got new values with the new rows.
+        :param depth: The depth of the node.
+        :return: The updated subtree, node itself if it kept its attribute.
+        """
+        summary = node.summary
+        # the new rows come last, so the counters keep the order in which values first appear, like generate_tree
+        class_counter = summary.class_counter
+        for class_type, count in new_rows.class_counter.items():
+            class_counter[class_type] = class_counter.get(class_type, 0) + count
+        total_count = sum(class_counter.values())
+        summary.default = default
+
+        if isinstance(node, ClassNode) or total_count == 0 or len(attributes) == 0 or \
+                sum(1 for count in class_counter.values() if count != 0) == 1:
+            return self._regenerate(node, new_rows, attributes, default, depth)
+
+        count_table = summary.count_table
+        for attribute, new_attribute_table in new_rows.count_table(attributes).items():
+            attribute_table = count_table[attribute]
+            for code, new_class_counts in new_attribute_table.items():
+                class_counts = attribute_table.setdefault(code, [])
+                class_counts.extend([0] * (len(new_class_counts) - len(class_counts)))
+                for class_code, count in enumerate(new_class_counts):
+                    class_counts[class_code] += count
+
+        best_attribute, best_gain = self._choose_attribute(class_counter, total_count, count_table, attributes)
+        if best_attribute != node.attribute or (self.min_gain is not None and best_gain < self.min_gain):
+            return self._regenerate(node, new_rows, attributes, default, depth)
+
+        new_default = max(class_counter.items(), key=lambda x: x[1])[0]
+        node.default = new_default
+        new_attributes = [x for x in attributes if x != best_attribute]
+        for choice, new_choice_rows in new_rows.split(best_attribute).items():
+            child = node.dict.get(choice)
+            if child is None:  # a value that was added to the data after the tree was generated
+                node.add_child_to_dict(choice, self.generate_tree(new_choice_rows, new_attributes, new_default,
+                                                                  depth + 1))
+            elif new_choice_rows.total_count != 0 or child.summary.default != new_default or \
+                    (isinstance(child, AttributeNode) and not grown_attributes.isdisjoint(new_attributes)):
+                child = self._update_node(child, new_choice_rows, new_attributes, new_default, grown_attributes,
+                                          depth + 1)
+                node.add_child_to_dict(choice, child)
+        return node
+
+    def _regenerate(self, node, new_rows, attributes, default, depth):
+        """
+        Generate a subtree again from its old rows and the new rows.
+        :param node: The root of the old subtree.
+        :param new_rows: View of the new rows of the subtree.
+        :param attributes: The attributes left for the subtree.
+        :param default: The default class the subtree gets from its parent.
+        :param depth: The depth of the subtree.
+        :return: The new subtree.
+        """
+        old_rows = heapq.merge(*(leaf.summary.rows for leaf in _iter_leaves(node)))
+        rows = array('i', old_rows)
+        rows.extend(new_rows.get_rows())
+        return self.generate_tree(DataView(new_rows.get_source(), rows), attributes, default, depth)
+
+    def calc_gain(self, decision_entropy, attribute, data, attribute_table=None):
         """
         Calculate the gain of an attribute on the current data.
         :param decision_entropy: The decision entropy of data.
         :param attribute: The attribute to check gain for.
         :param data: The data we are working on.
+        :param attribute_table: The count table of attribute in data, see DataObject.count_table. None to count it.
+        :return: The calculated gain.
+        """
+        if attribute_table is None:
+            attribute_table = data.count_table([attribute])[attribute]
+        return self._calc_gain_from_table(decision_entropy, attribute_table, data.total_count)
+
+    def _calc_gain_from_table(self, decision_entropy, attribute_table, total_count):
+        """
+        Calculate the gain of an attribute from its count table.
+        :param decision_entropy: The decision entropy of the rows.
+        :param attribute_table: The count table of the attribute.
+        :param total_count: The number of rows.
         :return: The calculated gain.
         """
         total_entropy = decision_entropy
-        attribute_options = data.dict_of_attributes[attribute]
-        attribute_count_dictionary = data.attributes_counter[attribute]
-        classes = data.get_all_classes()
-
-        for value in attribute_options:
-            yes_count = 0
-            no_count = 0
-            for entry in data.get_all_entries():
-                if entry.has_attribute(attribute, value):
-                    if entry.entry_class == classes[1]:
-                        yes_count += 1
-                    elif entry.entry_class == classes[0]:
-                        no_count += 1
-
-            total_value_count = attribute_count_dictionary[value]
-            yes_ratio, no_ratio = yes_count / total_value_count, no_count / total_value_count
-            value_ratio = total_value_count / data.total_count
-
-            if yes_ratio == 0 or no_ratio == 0:
-                entropy = 0
-            else:
-                entropy = -yes_ratio * log(yes_ratio, self.log_base) - no_ratio * log(no_ratio, self.log_base)
-            total_entropy -= value_ratio * entropy
+
+        for class_counts in attribute_table.values():
+            total_value_count = sum(class_counts)
+            value_ratio = total_value_count / total_count
+            total_entropy -= value_ratio * self.calc_entropy(class_counts, total_value_count)
 
         return total_entropy
 
+    def _draw_attributes(self, attributes):
+        """
+        Draw the attributes a node chooses from, see max_features.
+        :param attributes: The attributes left for the node.
+        :return: The attributes to choose from.
+        """
+        if self.max_features is None or self.max_features >= len(attributes):
+            return attributes
+        return self._random.sample(attributes, self.max_features)
+
+    def _choose_attribute(self, class_counter, total_count, count_table, attributes):
+        """
+        Choose the attribute with the best gain.
+        :param class_counter: The classes counter of the rows.
+        :param total_count: The number of rows.
+        :param count_table: The count table of the attributes.
+        :param attributes: The attributes to choose from.
+        :return: The best attribute and its gain.
+        """
+        if instrumentation.enabled:
+            instrumentation.count('id3.gain_evaluations', len(attributes))
+        entropy_dict = {}
+        decision_entropy = self.calc_entropy(class_counter.values(), total_count)
+
+        for attribute in attributes:
+            entropy_dict[attribute] = self._calc_gain_from_table(decision_entropy, count_table[attribute], total_count)
+
+        return max(entropy_dict.items(), key=lambda x: x[1])
+
     def calc_decision_entropy(self, data):
         """
-        Calculate the decision entropy of data. Assume 2 values.
+        Calculate the decision entropy of data.
         :param data: The given data.
         :return: The decision entropy.
         """
-        yes_count, no_count = 0, 0
-        classes = data.get_all_classes()
-
-        for entry in data.get_all_entries():
-            if entry.entry_class == classes[1]:
-                yes_count += 1
-            elif entry.entry_class == classes[0]:
-                no_count += 1
-
-        yes_ratio, no_ratio = yes_count / data.total_count, no_count / data.total_count
+        return self.calc_entropy(data.class_counter.values(), data.total_count)
 
-        if yes_ratio == 0 or no_ratio == 0:
-            entropy = 0
-        else:
-            entropy = -yes_ratio * log(yes_ratio, self.log_base) - no_ratio * log(no_ratio, self.log_base)
+    def calc_entropy(self, counts, total_count):
+        """
+        Calculate the entropy of a distribution, for any number of classes.
+        :param counts: The count of every class.
+        :param total_count: The sum of counts.
+        :return: The entropy.
+        """
+        entropy = 0
+        for count in counts:
+            if count != 0:
+                ratio = count / total_count
+                entropy -= ratio * log(ratio, self.log_base)
         return entropy
 
     def write_tree_to_file(self):
@@ -158,3 +532,112 @@ class ID3(object):
         :return:
         """
         return 'DT'
+
+
+_worker_shared_memory = None
+_worker_id3 = None
+
+
+def _init_worker(shared, options):
+    """
+    Attach a process of the pool to the shared rows.
+    :param shared: The handle of the shared rows, see shared_data.
+    :param options: The options of the ID3, see ID3.get_options.
+    :return: None.
+    """
+    global _worker_shared_memory, _worker_id3
+    _worker_shared_memory, data = attach_shared_data(shared)
+    _worker_id3 = ID3(data, **options)
+
+
+def _generate_subtree(rows, attributes, default, depth):
+    """
+    Generate a subtree in a process of the pool.
+    :param rows: The rows of the subtree in the shared data.
+    :param attributes: The attributes left.
+    :param default: The default class in case of tie.
+    :param depth: The depth of the subtree.
+    :return: The subtree.
+    """
+    return _worker_id3.generate_tree(DataView(_worker_id3.data, rows), attributes, default, depth)
+
+
+def _count_level(data, codes_path, nodes_path, routes, nodes_number):
+    """
+    Make one pass over the codes file of an out of core build: move every row from its node of the previous level to
+    its node of this level, write the new nodes of the rows and count the classes of every node.
+    :param data: The data object with the encoding.
+    :param codes_path: The codes file, see encode_file.
+    :param nodes_path: The file of the node of every row, -1 for rows in leaves. It is replaced by the new nodes.
+    :param routes: The routes of the nodes of the previous level, see ID3._grow_node, None for the first level.
+    :param nodes_number: The number of nodes of this level.
+    :return: (classes counter of every node, count table of every node as a list by attribute index).
+    """
+    classes_number = len(data.class_values)
+    class_counters = [{} for _ in range(nodes_number)]  # {class code: count}, in the order the classes first appear
+    tables = [[{} for _ in data.attributes_names] for _ in range(nodes_number)]
+    new_nodes_path = nodes_path + '.next'
+
+    with open(new_nodes_path, 'wb') as new_nodes_file, \
+            open(nodes_path if routes is not None else os.devnull, 'rb') as nodes_file:
+        for columns, classes in iter_encoded_chunks(codes_path, len(data.attributes_names)):
+            rows_number = len(classes)
+            if routes is None:
+                nodes = array('i', [0]) * rows_number
+            else:
+                old_nodes = array('i')
+                old_nodes.fromfile(nodes_file, rows_number)
+                nodes = array('i', [-1]) * rows_number
+                for row, node in enumerate(old_nodes):
+                    if node >= 0:
+                        route = routes[node]
+                        if route is not None:
+                            nodes[row] = route[1][columns[route[0]][row]]
+            nodes.tofile(new_nodes_file)
+
+            for (node, class_code), count in Counter(zip(nodes, classes)).items():
+                if node >= 0:
+                    class_counter = class_counters[node]
+                    class_counter[class_code] = class_counter.get(class_code, 0) + count
+            for attribute_index, column in enumerate(columns):
+                for (node, code, class_code), count in Counter(zip(nodes, column, classes)).items():
+                    if node >= 0:
+                        attribute_table = tables[node][attribute_index]
+                        if code not in attribute_table:
+                            attribute_table[code] = [0] * classes_number
+                        attribute_table[code][class_code] += count
+
+    os.replace(new_nodes_path, nodes_path)
+    class_values = data.class_values
+    return [{class_values[code]: count for code, count in class_counter.items()}
+            for class_counter in class_counters], tables
+
+
+def _resolve_futures(node, consolidate=False):
+    """
+    Replace the futures in a tree by the subtrees they computed.
+    :param node: The root of the tree.
+    :param consolidate: True to consolidate the nodes above the futures again, now that their children are known.
+    :return: The root without futures.
+    """
+    if isinstance(node, Future):
+        return node.result()
+    if isinstance(node, AttributeNode):
+        for value, child in node.dict.items():
+            node.dict[value] = _resolve_futures(child, consolidate)
+        if consolidate:
+            return check_for_consolidation(node)
+    return node
+
+
+def _iter_leaves(node):
+    """
+    Iterate over the class nodes of a tree.
+    :param node: The root of the tree.
+    :return: Generator of the class nodes.
+    """
+    if isinstance(node, ClassNode):
+        yield node
+    else:
+        for child in node.dict.values():
+            yield from _iter_leaves(child)
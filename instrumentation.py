@@ -0,0 +1,162 @@
+import cProfile
+import time
+
+
+class _NoTimer(object):
+    """
+    The timer of a disabled instrumentation, it does nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NO_TIMER = _NoTimer()
+
+
+class _Timer(object):
+
+    def __init__(self, instrumentation, name, items):
+        """
+        Construct a timer that adds its time to a named timer of the instrumentation.
+        :param instrumentation: The instrumentation.
+        :param name: The name of the timer.
+        :param items: How many items the timed block handles.
+        """
+        self.instrumentation = instrumentation
+        self.name = name
+        self.items = items
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.instrumentation.add_time(self.name, time.perf_counter() - self.start, self.items)
+        return False
+
+
+class Instrumentation(object):
+
+    def __init__(self):
+        """
+        Construct the counters and timers of a run, disabled.
+        The hot paths check enabled before they count, so a disabled instrumentation costs one attribute lookup.
+        """
+        self.enabled = False
+        self.counters = {}  # {name: count}
+        self.timers = {}  # {name: [calls, total seconds, max seconds, items]}
+
+    def enable(self):
+        """
+        Start counting and timing.
+        :return: None.
+        """
+        self.enabled = True
+
+    def disable(self):
+        """
+        Stop counting and timing, the collected values are kept.
+        :return: None.
+        """
+        self.enabled = False
+
+    def reset(self):
+        """
+        Forget all the collected values.
+        :return: None.
+        """
+        self.counters = {}
+        self.timers = {}
+
+    def count(self, name, amount=1):
+        """
+        Add to a counter.
+        :param name: The name of the counter.
+        :param amount: How much to add.
+        :return: None.
+        """
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def timer(self, name, items=1):
+        """
+        Time a block: with instrumentation.timer('phase'): ...
+        :param name: The name of the timer, every use adds a call.
+        :param items: How many items the block handles, like the rows of a batch, for the time per item.
+        :return: The context manager.
+        """
+        if not self.enabled:
+            return _NO_TIMER
+        return _Timer(self, name, items)
+
+    def add_time(self, name, seconds, items=1):
+        """
+        Add a call of seconds to a timer.
+        :param name: The name of the timer.
+        :param seconds: The time of the call.
+        :param items: How many items the call handled.
+        :return: None.
+        """
+        timer = self.timers.get(name)
+        if timer is None:
+            self.timers[name] = [1, seconds, seconds, items]
+        else:
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+            timer[3] += items
+
+    def report(self):
+        """
+        Construct a report of the timers, in the order they were first used, and of the counters. The mean and the
+        max are of the calls, the time per item is the total divided by the items of all the calls.
+        :return: The report string.
+        """
+        lines = ['%-32s %10s %12s %12s %12s %10s %14s' % ('timer', 'calls', 'total (s)', 'mean (s)', 'max (s)',
+                                                          'items', 'per item (s)')]
+        for name, (calls, total, longest, items) in self.timers.items():
+            per_item = total / items if items else 0
+            lines.append('%-32s %10d %12.6f %12.6f %12.6f %10d %14.9f' % (name, calls, total, total / calls, longest,
+                                                                          items, per_item))
+        lines.append('')
+        lines.append('%-32s %10s' % ('counter', 'count'))
+        for name, count in sorted(self.counters.items()):
+            lines.append('%-32s %10d' % (name, count))
+        return '\n'.join(lines) + '\n'
+
+
+# the instrumentation of all the modules
+instrumentation = Instrumentation()
+
+
+def percentile(sorted_values, percent):
+    """
+    The nearest rank percentile of sorted values.
+    :param sorted_values: The values, ascending.
+    :param percent: The percentile, between 0 and 100.
+    :return: The value.
+    """
+    rank = max(1, -(-len(sorted_values) * percent // 100))
+    return sorted_values[rank - 1]
+
+
+def profile(function, file_path, *args, **kwargs):
+    """
+    Run a function under cProfile and save the stats, they can be read with pstats or turned into a flame graph by
+    tools like snakeviz or flameprof.
+    :param function: The function to run.
+    :param file_path: The path of the stats file.
+    :param args: The arguments of the function.
+    :param kwargs: The keyword arguments of the function.
+    :return: The result of the function.
+    """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args, **kwargs)
+    finally:
+        profiler.dump_stats(file_path)
@@ -1,45 +1,515 @@
+import heapq
+import random
+import time
+from array import array
+from collections import Counter
+from itertools import islice
+
+from data_object import DataObject
+from instrumentation import instrumentation
+from model_io import read_model, write_model
+from prediction_cache import next_model_id, shared_cache
+
+_BITS_TO_CHARS = bytes.maketrans(b'\x00\x01', b'01')
+
+
+def rows_mask(flags):
+    """
+    Pack a sequence of row flags into a bit mask, bit r is set when flags[r] is true.
+    :param flags: bytes of 0 and 1, one for every row.
+    :return: The mask.
+    """
+    if not flags:
+        return 0
+    return int(flags.translate(_BITS_TO_CHARS)[::-1], 2)
+
+
 class Knn(object):
 
-    def __init__(self, data, k):
+    def __init__(self, data, k, cache=shared_cache, indexed=False, hash_tables=0, hash_size=None, probes=None, seed=0):
         """
         Construct KNN algorithm.
+        Rows with the same values are grouped into one pattern with a counter of its classes, and the patterns are bit
+        packed: every (attribute, value) gets a mask with a bit for each pattern, so the distances to all the patterns
+        are calculated together with a few operations on whole masks.
+        An indexed KNN keeps an inverted index instead of the masks, the patterns of every (attribute, value), and a
+        query only touches the patterns that share values with it. It is faster for many attributes with little
+        overlap between the rows.
+        With hash tables the search is approximate, locality sensitive hashing by bit sampling: every table hashes the
+        patterns by the values of a random subset of the attributes, and only the patterns in the buckets of the query
+        are candidates. Near patterns share a bucket in some table with a high probability. More tables and probes
+        find more of the nearest rows, a bigger hash size finds less candidates, see measure_recall.
         :param data: given data to train on.
         :param k: an integer. MUST BE ODD!
+        :param cache: The prediction cache of predict and predict_codes, None to not cache the predictions.
+        :param indexed: True to search with the inverted index.
+        :param hash_tables: The number of hash tables, 0 for an exact search.
+        :param hash_size: The number of attributes every table hashes, None for a quarter of the attributes.
+        :param probes: How many of the tables a query looks in, None for all of them, see set_probes.
+        :param seed: The random seed of the attributes of the tables.
         """
         if k % 2 == 0:
             raise ValueError("k must be odd!")
 
-        self.data = data
+        self.data = data.copy_encoding()  # the masks and postings are sized to the encoding of now
         self.k = k
-        self.k_nearest = []
+        self.cache = cache
+        self.model_id = next_model_id()
+        self.version = 0  # changes with the probes, so the cache does not return predictions of other probes
+
+        classes_number = len(data.class_values)
+        patterns_indexes = {}
+        self.patterns = []  # the distinct codes tuples, in the order they first appear
+        self.pattern_rows = []  # the rows of every pattern, ascending
+        self.pattern_class_counts = []  # [[count of class code 0, count of class code 1..] for every pattern]
+        self.pattern_first_rows = []  # [[first row of class code 0 or -1, ..] for every pattern]
+        self.class_column = data.class_column
+
+        columns = [data.get_column(attribute) for attribute in data.get_all_attributes()]
+        for row, (pattern, class_code) in enumerate(zip(zip(*columns), data.class_column)):
+            pattern_index = patterns_indexes.get(pattern)
+            if pattern_index is None:
+                pattern_index = patterns_indexes[pattern] = len(self.patterns)
+                self.patterns.append(pattern)
+                self.pattern_rows.append(array('i'))
+                self.pattern_class_counts.append(array('i', [0]) * classes_number)
+                self.pattern_first_rows.append(array('i', [-1]) * classes_number)
+            self.pattern_rows[pattern_index].append(row)
+            self.pattern_class_counts[pattern_index][class_code] += 1
+            if self.pattern_first_rows[pattern_index][class_code] < 0:
+                self.pattern_first_rows[pattern_index][class_code] = row
+
+        self.all_patterns = (1 << len(self.patterns)) - 1
+        attributes_number = len(data.get_all_attributes())
+        hash_size = min(attributes_number, hash_size or max(1, attributes_number // 4))
+        generator = random.Random(seed)
+        # the attributes indexes of every hash table, sorted
+        self.hash_attributes = [tuple(sorted(generator.sample(range(attributes_number), hash_size)))
+                                for _ in range(hash_tables)]
+        self.probes = hash_tables if probes is None else min(probes, hash_tables)
+        self._build_buckets()
+
+        self.indexed = indexed
+        # postings[attribute index][value code] is the array of the patterns with that value, ascending
+        self.postings = None
+        # value_masks[attribute index][value code] is the mask of the patterns with that value
+        self.value_masks = None
+        if indexed:
+            self.postings = [[array('i') for _ in codes] for codes in data.value_codes]
+            for pattern_index, pattern in enumerate(self.patterns):
+                for attribute_postings, code in zip(self.postings, pattern):
+                    attribute_postings[code].append(pattern_index)
+            return
+
+        self.value_masks = []
+        for attribute_index, attribute in enumerate(data.get_all_attributes()):
+            pattern_column = [pattern[attribute_index] for pattern in self.patterns]
+            self.value_masks.append([rows_mask(bytes(map(code.__eq__, pattern_column)))
+                                     for code in range(len(data.value_codes[attribute_index]))])
+
+    def save(self, file_path):
+        """
+        Save the encoded training patterns and their masks in a binary model file.
+        :param file_path: The path of the file.
+        :return: None.
+        """
+        pattern_offsets = array('i', [0])
+        for rows in self.pattern_rows:
+            pattern_offsets.append(pattern_offsets[-1] + len(rows))
+        arrays = {'patterns': array('i', [code for pattern in self.patterns for code in pattern]),
+                  'pattern_offsets': pattern_offsets,
+                  'pattern_rows': array('i', [row for rows in self.pattern_rows for row in rows]),
+                  'pattern_class_counts': array('i', [count for counts in self.pattern_class_counts
+                                                      for count in counts]),
+                  'pattern_first_rows': array('i', [row for rows in self.pattern_first_rows for row in rows]),
+                  'class_column': array('i', self.class_column),
+                  'hash_attributes': array('i', [index for attributes in self.hash_attributes for index in attributes])}
+        if self.indexed:
+            postings = [posting for attribute_postings in self.postings for posting in attribute_postings]
+            posting_offsets = array('i', [0])
+            for posting in postings:
+                posting_offsets.append(posting_offsets[-1] + len(posting))
+            arrays['postings'] = array('i', [pattern for posting in postings for pattern in posting])
+            arrays['posting_offsets'] = posting_offsets
+        else:
+            masks_bytes = (len(self.patterns) + 7) // 8
+            for attribute_index, masks in enumerate(self.value_masks):
+                for code, mask in enumerate(masks):
+                    arrays['mask%d_%d' % (attribute_index, code)] = array('B', mask.to_bytes(masks_bytes, 'little'))
+
+        header = {'encoding': self.data.get_encoding(), 'k': self.k, 'indexed': self.indexed,
+                  'hash_tables': len(self.hash_attributes), 'probes': self.probes}
+        write_model(file_path, 'Knn', header, arrays)
+
+    @staticmethod
+    def load(file_path):
+        """
+        Load a KNN saved by save, it can predict but it has no data rows. The patterns, their rows and the value masks
+        stay in the memory mapped file, so processes that load it share their pages. A value mask is turned into an
+        integer for the bit operations the first time a query uses it, that integer is private to the process.
+        :param file_path: The path of the file.
+        :return: The KNN.
+        """
+        header, arrays = read_model(file_path, 'Knn')
+        knn = Knn.__new__(Knn)
+        knn.data = DataObject.from_encoding(header['encoding'])
+        knn.k = header['k']
+        knn.cache = shared_cache
+        knn.model_id = next_model_id()
+        knn.version = 0
+        knn.class_column = arrays['class_column']
+
+        attributes_number = len(knn.data.attributes_names)
+        classes_number = len(knn.data.class_values)
+        offsets = arrays['pattern_offsets']
+        patterns_number = len(offsets) - 1
+        knn.patterns = _MappedPatterns(arrays['patterns'], attributes_number, patterns_number)
+        knn.pattern_rows = [arrays['pattern_rows'][offsets[i]:offsets[i + 1]] for i in range(patterns_number)]
+        knn.pattern_class_counts = [arrays['pattern_class_counts'][i * classes_number:(i + 1) * classes_number]
+                                    for i in range(patterns_number)]
+        knn.pattern_first_rows = [arrays['pattern_first_rows'][i * classes_number:(i + 1) * classes_number]
+                                  for i in range(patterns_number)]
+
+        knn.all_patterns = (1 << patterns_number) - 1
+        hash_tables = header.get('hash_tables', 0)
+        hash_attributes = arrays.get('hash_attributes', ())
+        hash_size = len(hash_attributes) // hash_tables if hash_tables else 0
+        knn.hash_attributes = [tuple(hash_attributes[i * hash_size:(i + 1) * hash_size]) for i in range(hash_tables)]
+        knn.probes = header.get('probes', 0)
+        knn._build_buckets()
+
+        knn.indexed = header.get('indexed', False)
+        knn.postings = None
+        knn.value_masks = None
+        if knn.indexed:
+            postings, offsets = arrays['postings'], arrays['posting_offsets']
+            knn.postings = []
+            posting_index = 0
+            for codes in knn.data.value_codes:
+                knn.postings.append([postings[offsets[i]:offsets[i + 1]]
+                                     for i in range(posting_index, posting_index + len(codes))])
+                posting_index += len(codes)
+        else:
+            knn.value_masks = [_MappedMasks([arrays['mask%d_%d' % (attribute_index, code)]
+                                             for code in range(len(codes))])
+                               for attribute_index, codes in enumerate(knn.data.value_codes)]
+        return knn
+
+    def _build_buckets(self):
+        """
+        Hash the patterns into the buckets of every hash table.
+        :return: None.
+        """
+        # buckets[table][values of the attributes of the table] is the array of the patterns in the bucket, ascending
+        self.buckets = []
+        for attributes in self.hash_attributes:
+            table = {}
+            for pattern_index, pattern in enumerate(self.patterns):
+                key = tuple(pattern[attribute_index] for attribute_index in attributes)
+                bucket = table.get(key)
+                if bucket is None:
+                    bucket = table[key] = array('i')
+                bucket.append(pattern_index)
+            self.buckets.append(table)
+
+    def set_probes(self, probes):
+        """
+        Set how many hash tables a query looks in, the knob between recall and latency. The cached predictions of the
+        other probes are not used.
+        :param probes: The number of tables, at most the number of hash tables.
+        :return: None.
+        """
+        self.probes = min(probes, len(self.hash_attributes))
+        self.version += 1
+
+    def measure_recall(self, rows):
+        """
+        Compare the approximate search with the exact search on some queries, without the cache.
+        The recall of a query is the share of its approximate k nearest rows that are as near as the exact k-th row,
+        so rows at the same distance are as good as each other.
+        :param rows: Encoded queries, see DataObject.encode_rows.
+        :return: {'recall': mean recall, 'agreement': share of equal predictions, 'fallbacks': share of queries with too
+         few candidates that were searched exactly, 'exact_seconds': mean time of an exact query,
+         'approximate_seconds': mean time of an approximate query}.
+        """
+        recall = agreement = fallbacks = exact_seconds = approximate_seconds = 0
+        for codes in rows:
+            start = time.perf_counter()
+            exact_levels = [(distance, list(level)) for distance, level in self._exact_levels(codes)]
+            exact_prediction = self._vote(exact_levels)
+            exact_seconds += time.perf_counter() - start
+
+            start = time.perf_counter()
+            approximate_levels = self._approximate_levels(codes)
+            if approximate_levels is None:  # too few candidates, the search falls back to the exact one
+                approximate_levels = exact_levels
+                fallbacks += 1
+            approximate_prediction = self._vote(approximate_levels)
+            approximate_seconds += time.perf_counter() - start
+
+            exact_distances = self._nearest_distances(exact_levels)
+            approximate_distances = self._nearest_distances(approximate_levels)
+            if exact_distances:
+                recall += sum(1 for distance in approximate_distances if distance <= exact_distances[-1]) / len(
+                    exact_distances)
+            else:
+                recall += 1
+            agreement += approximate_prediction == exact_prediction
+
+        rows_number = max(1, len(rows))
+        return {'recall': recall / rows_number, 'agreement': agreement / rows_number,
+                'fallbacks': fallbacks / rows_number, 'exact_seconds': exact_seconds / rows_number,
+                'approximate_seconds': approximate_seconds / rows_number}
 
     def predict(self, entry):
         """
         Predict what entry class will be.
+        The k nearest rows are the rows with the smallest hamming distance, on equal distance the rows that come
+        first in the data are nearer. If some classes have the same number of neighbors, the class of the nearest
+        neighbor among them wins.
         :param entry: the entry to predict.
         :return: The predication.
         """
-        self.k_nearest = [(float('inf'), None) for _ in range(self.k)]
+        return self.predict_codes(self.data.encode_entry(entry))
 
-        for data_entry in self.data.get_all_entries():
-            current_dist = entry - data_entry
-            self._add_to_k_nearest(current_dist, data_entry.entry_class)
+    def predict_batch(self, rows):
+        """
+        Predict many encoded rows, every distinct row is searched only once.
+        :param rows: Codes tuples in the order of the attributes of self.data, see DataObject.encode_rows.
+        :return: List of the predictions.
+        """
+        predictions = {}
+        for row in rows:
+            if row not in predictions:
+                predictions[row] = self.predict_codes(row)
+        return [predictions[row] for row in rows]
 
-        only_classes = [x[1] for x in self.k_nearest]
-        return max(only_classes, key=only_classes.count)
+    def predict_codes(self, codes):
+        """
+        Predict the class for encoded values, repeated queries are answered from the cache.
+        :param codes: The codes of the values, -1 for a value the data never had.
+        :return: The prediction.
+        """
+        if instrumentation.enabled:
+            instrumentation.count('knn.queries')
+        if self.cache is None:
+            return self._predict_codes(codes)
+        return self.cache.predict(self, tuple(codes), self._predict_codes)
 
-    def _add_to_k_nearest(self, current_dist, entry_class):
+    def _predict_codes(self, codes):
         """
-        Adding the distance and entry class to k nearest.
-        :param current_dist: The distance.
-        :param entry_class: The entry class.
-        :return: None.
+        Predict the class for encoded values with a search.
+        :param codes: The codes of the values.
+        :return: The prediction.
+        """
+        return self.data.class_values[self._search(codes)]
+
+    def _search(self, codes):
+        """
+        Find the k nearest rows of the codes and vote, approximately if there are hash tables.
+        :param codes: The codes of the values.
+        :return: The predicted class code.
+        """
+        levels = self._approximate_levels(codes) if self.probes else None
+        if levels is None:
+            levels = self._exact_levels(codes)
+        return self._vote(levels)
+
+    def _exact_levels(self, codes):
+        """
+        Find the patterns by their distance to the codes, with the inverted index or with the masks.
+        :param codes: The codes of the values.
+        :return: Iterable of (distance, patterns at that distance ascending), by ascending distance, see _vote.
+        """
+        return self._index_levels(codes) if self.indexed else self._mask_levels(codes)
+
+    def _approximate_levels(self, codes):
+        """
+        Find the candidates of the codes in the buckets of the first probes hash tables, by their distance.
+        :param codes: The codes of the values.
+        :return: List of (distance, patterns at that distance ascending), by ascending distance, or None if the
+         candidates have less than k rows.
+        """
+        candidates = set()
+        for attributes, table in zip(self.hash_attributes[:self.probes], self.buckets):
+            bucket = table.get(tuple(codes[attribute_index] for attribute_index in attributes))
+            if bucket is not None:
+                candidates.update(bucket)
+        if sum(len(self.pattern_rows[pattern]) for pattern in candidates) < self.k:
+            return None
+
+        if instrumentation.enabled:
+            instrumentation.count('knn.distance_computations', len(candidates))
+        levels = {}
+        for pattern in candidates:
+            distance = sum(1 for pattern_code, code in zip(self.patterns[pattern], codes) if pattern_code != code)
+            levels.setdefault(distance, []).append(pattern)
+        return [(distance, sorted(levels[distance])) for distance in sorted(levels)]
+
+    def _mask_levels(self, codes):
+        """
+        Find the patterns by their distance to the codes with the masks.
+        :param codes: The codes of the values.
+        :return: Iterable of (distance, patterns at that distance ascending), by ascending distance, see _vote.
+        """
+        if instrumentation.enabled:
+            # the distances of all the patterns are calculated together
+            instrumentation.count('knn.distance_computations', len(self.patterns))
+        distance_bits = self._calc_distance_bits(codes)
+        return ((distance, list(_bits_indexes(self._patterns_at_distance(distance_bits, distance))))
+                for distance in range(len(codes) + 1))
+
+    def _index_levels(self, codes):
+        """
+        Find the patterns by their distance to the codes with the inverted index.
+        The distance of a pattern is the number of attributes minus its matches, the matches are counted from the
+        postings of the values of the codes, the shortest first. After j of the n postings a pattern that was not
+        seen has at most n - j matches, so when at least k rows of seen patterns have more, no new pattern can be
+        among the nearest: the rest of the values are only compared with the seen patterns that can still be.
+        :param codes: The codes of the values.
+        :return: Iterable of (distance, patterns at that distance ascending), by ascending distance, see _vote.
+        """
+        postings = sorted(((self.postings[attribute_index][code], attribute_index, code)
+                           for attribute_index, code in enumerate(codes)
+                           if 0 <= code < len(self.postings[attribute_index])), key=lambda x: len(x[0]))
+        matches = Counter()  # {pattern: number of matches}
+        scanned = 0
+        kth_matches, kth_step = 0, -1  # the last bound of the k-th row, it grows by at most 1 with every posting
+
+        for j, (posting, _, _) in enumerate(postings):
+            matches.update(posting)
+            scanned += len(posting)
+            left = len(postings) - j - 1
+            if left < kth_matches + j - kth_step:
+                kth_matches, kth_step = self._kth_matches(matches), j
+            if left < kth_matches and kth_step == j:
+                # a seen pattern that can not reach the k-th row is not among the nearest either
+                matches = {pattern: pattern_matches for pattern, pattern_matches in matches.items()
+                           if pattern_matches + left >= kth_matches}
+                rest = postings[j + 1:]
+                if len(matches) * len(rest) < sum(len(posting) for posting, _, _ in rest):
+                    for pattern in matches:
+                        pattern_codes = self.patterns[pattern]
+                        matches[pattern] += sum(1 for _, attribute_index, code in rest
+                                                if pattern_codes[attribute_index] == code)
+                else:
+                    for posting, _, _ in rest:
+                        scanned += len(posting)
+                        for pattern in posting:
+                            if pattern in matches:
+                                matches[pattern] += 1
+                complete = False
+                break
+        else:
+            complete = True
+
+        if instrumentation.enabled:
+            instrumentation.count('knn.postings_scanned', scanned)
+            instrumentation.count('knn.distance_computations', len(matches))
+
+        levels = {}
+        for pattern, pattern_matches in matches.items():
+            levels.setdefault(len(codes) - pattern_matches, []).append(pattern)
+        levels = [(distance, sorted(levels[distance])) for distance in sorted(levels)]
+        if complete:
+            # the patterns without a match are the farthest, they are listed only if they are needed
+            levels.append((len(codes), (pattern for pattern in range(len(self.patterns)) if pattern not in matches)))
+        return levels
+
+    def _kth_matches(self, matches):
+        """
+        A lower bound of the matches of the k-th row, when the rows are ordered by their matches: the matches of the
+        k-th pattern, every pattern has at least one row.
+        :param matches: {pattern: number of matches}.
+        :return: The bound, 0 if there are less than k patterns.
+        """
+        if len(matches) < self.k:
+            return 0
+        return heapq.nlargest(self.k, matches.values())[-1]
+
+    def _nearest_distances(self, levels):
+        """
+        The distances of the k nearest rows.
+        :param levels: List of (distance, patterns at that distance), by ascending distance, see _vote.
+        :return: List of the distances, ascending.
+        """
+        distances = []
+        for distance, level in levels:
+            if len(distances) >= self.k:
+                break
+            level_count = sum(len(self.pattern_rows[pattern]) for pattern in level)
+            distances.extend([distance] * min(level_count, self.k - len(distances)))
+        return distances
+
+    def _vote(self, levels):
+        """
+        Take the k nearest rows, level by level, and vote.
+        :param levels: Iterable of (distance, patterns at that distance ascending), by ascending distance.
+        :return: The predicted class code.
         """
-        for i, k_entry in enumerate(self.k_nearest):
-            if current_dist < k_entry[0]:
-                self.k_nearest[i] = (current_dist, entry_class)
-                # when we find the right spot, we can just exit
-                return
+        class_column = self.class_column
+        votes = [0] * len(self.data.class_values)
+        nearest = {}  # {class code: (distance, row) of its nearest neighbor}
+        left = self.k
+
+        for distance, level in levels:
+            if left <= 0:
+                break
+            level = list(level)
+            level_count = sum(len(self.pattern_rows[pattern]) for pattern in level)
+
+            if level_count <= left:
+                for pattern in level:
+                    for class_code, (count, first_row) in enumerate(zip(self.pattern_class_counts[pattern],
+                                                                        self.pattern_first_rows[pattern])):
+                        if count:
+                            votes[class_code] += count
+                            nearest[class_code] = min(nearest.get(class_code, (distance, first_row)),
+                                                      (distance, first_row))
+            else:
+                # only some of the rows at this distance are needed, take the first ones in the data
+                for row in islice(heapq.merge(*(self.pattern_rows[pattern] for pattern in level)), left):
+                    class_code = class_column[row]
+                    votes[class_code] += 1
+                    nearest.setdefault(class_code, (distance, row))
+            left -= level_count
+
+        return max(sorted(nearest, key=nearest.get), key=votes.__getitem__)
+
+    def _calc_distance_bits(self, codes):
+        """
+        Calculate the hamming distances of all patterns to the codes, bit sliced: distance_bits[j] is the mask of the
+        patterns whose distance has bit j set.
+        :param codes: The codes of the values.
+        :return: The distance bits.
+        """
+        distance_bits = []
+
+        for masks, code in zip(self.value_masks, codes):
+            carry = self.all_patterns ^ masks[code] if 0 <= code < len(masks) else self.all_patterns
+            for j, bit in enumerate(distance_bits):
+                distance_bits[j] = bit ^ carry
+                carry &= bit
+                if not carry:
+                    break
+            if carry:
+                distance_bits.append(carry)
+
+        return distance_bits
+
+    def _patterns_at_distance(self, distance_bits, distance):
+        """
+        Return the mask of the patterns at exactly distance.
+        :param distance_bits: The bit sliced distances.
+        :param distance: The distance.
+        :return: The mask.
+        """
+        if distance >> len(distance_bits):
+            return 0
+        level = self.all_patterns
+        for j, bit in enumerate(distance_bits):
+            level &= bit if distance >> j & 1 else ~bit
+        return level
 
     def __repr__(self):
         """
@@ -47,3 +517,93 @@ class Knn(object):
         :return: String of representation.
         """
         return 'KNN'
+
+
+def _bits_indexes(mask):
+    """
+    Iterate over the indexes of the set bits of mask, from the lowest.
+    :param mask: The mask.
+    :return: Generator of indexes.
+    """
+    while mask:
+        bit = mask & -mask
+        yield bit.bit_length() - 1
+        mask ^= bit
+
+
+class _MappedPatterns(object):
+
+    def __init__(self, codes, width, patterns_number):
+        """
+        Construct the patterns of a loaded KNN over the codes array of the model file, a pattern is a slice of it and
+        nothing is copied.
+        :param codes: The codes of all the patterns, one after the other.
+        :param width: The number of codes of a pattern.
+        :param patterns_number: The number of patterns.
+        """
+        self.codes = codes
+        self.width = width
+        self.patterns_number = patterns_number
+
+    def __len__(self):
+        """
+        Return the number of patterns.
+        :return: The number of patterns.
+        """
+        return self.patterns_number
+
+    def __getitem__(self, index):
+        """
+        Return a pattern.
+        :param index: The index of the pattern.
+        :return: Memory view of the codes of the pattern.
+        """
+        if not 0 <= index < self.patterns_number:
+            raise IndexError('pattern index out of range')
+        return self.codes[index * self.width:(index + 1) * self.width]
+
+    def __iter__(self):
+        """
+        Iterate over the patterns in their order.
+        :return: Generator of the patterns.
+        """
+        for index in range(self.patterns_number):
+            yield self[index]
+
+
+class _MappedMasks(object):
+
+    def __init__(self, buffers):
+        """
+        Construct the value masks of an attribute of a loaded KNN over their bytes in the model file, a mask is turned
+        into an integer only when it is first used.
+        :param buffers: The little endian bytes of the mask of every value code.
+        """
+        self.buffers = buffers
+        self.masks = [None] * len(buffers)
+
+    def __len__(self):
+        """
+        Return the number of values of the attribute.
+        :return: The number of masks.
+        """
+        return len(self.buffers)
+
+    def __getitem__(self, code):
+        """
+        Return the mask of a value, decode it if it is the first use.
+        :param code: The code of the value.
+        :return: The mask.
+        """
+        mask = self.masks[code]
+        if mask is None:
+            mask = self.masks[code] = int.from_bytes(self.buffers[code], 'little')
+        return mask
+
+    def __iter__(self):
+        """
+        Iterate over the masks in the order of the codes.
+        :return: Generator of the masks.
+        """
+        for code in range(len(self.buffers)):
+            yield self[code]
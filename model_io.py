@@ -0,0 +1,69 @@
+import json
+import mmap
+import struct
+
+MAGIC = b'AIEX2MDL'
+_LENGTH = struct.Struct('<Q')
+_ALIGNMENT = 8
+
+
+def _align(offset):
+    """
+    Round offset up to the alignment of the arrays in the file.
+    :param offset: The offset.
+    :return: The aligned offset.
+    """
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def write_model(file_path, kind, header, arrays):
+    """
+    Write a model in the binary format: the magic, the length of a json header, the json header and then the raw
+    bytes of every array, aligned so they can be memory mapped.
+    :param file_path: The path of the file.
+    :param kind: The kind of the model, checked when loading.
+    :param header: Dictionary of json values of the model.
+    :param arrays: {name: array}, arrays of the array module or memory views of a loaded model.
+    :return: None.
+    """
+    directory = []
+    offset = 0
+    for name, values in arrays.items():
+        typecode = values.format if isinstance(values, memoryview) else values.typecode
+        directory.append([name, typecode, offset, len(values) * values.itemsize])
+        offset = _align(offset + len(values) * values.itemsize)
+
+    header_bytes = json.dumps({'kind': kind, 'header': header, 'arrays': directory}).encode('utf-8')
+    data_start = _align(len(MAGIC) + _LENGTH.size + len(header_bytes))
+
+    with open(file_path, 'wb') as model_file:
+        model_file.write(MAGIC + _LENGTH.pack(len(header_bytes)) + header_bytes)
+        for (name, typecode, offset, size), values in zip(directory, arrays.values()):
+            model_file.write(b'\0' * (data_start + offset - model_file.tell()))
+            model_file.write(values.tobytes())
+
+
+def read_model(file_path, kind):
+    """
+    Read a model written by write_model. The arrays are memory mapped and not copied, so processes that load the same
+    file share its pages.
+    :param file_path: The path of the file.
+    :param kind: The expected kind of the model.
+    :return: The header and {name: read only memory view of the array}.
+    """
+    with open(file_path, 'rb') as model_file:
+        mapped = mmap.mmap(model_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if mapped[:len(MAGIC)] != MAGIC:
+        raise ValueError('%s is not a model file' % file_path)
+    header_length, = _LENGTH.unpack_from(mapped, len(MAGIC))
+    header_start = len(MAGIC) + _LENGTH.size
+    description = json.loads(mapped[header_start:header_start + header_length].decode('utf-8'))
+    if description['kind'] != kind:
+        raise ValueError('%s holds a %s model, not %s' % (file_path, description['kind'], kind))
+
+    data_start = _align(header_start + header_length)
+    buffer = memoryview(mapped)
+    arrays = {name: buffer[data_start + offset:data_start + offset + size].cast(typecode)
+              for name, typecode, offset, size in description['arrays']}
+    return description['header'], arrays
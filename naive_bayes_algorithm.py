@@ -1,13 +1,232 @@
+from array import array
+from collections import Counter
+from math import log
+
+from data_object import DataObject
+from instrumentation import instrumentation
+from model_io import read_model, write_model
+from prediction_cache import next_model_id, shared_cache
+
+
 class NaiveBayes(object):
-    def __init__(self, data):
+    def __init__(self, data, count_table=None, cache=shared_cache):
         """
         Build naive bayes algorithm with a given data.
+        All the counting is done here once, prediction only sums log probabilities from the tables.
         :param data: The naive bayes algorithm.
+        :param count_table: The count table of all the attributes of data if it was already counted, see
+         DataObject.count_table.
+        :param cache: The prediction cache of predict and predict_codes, None to not cache the predictions.
         """
-        self.data = data
+        # the model learns new values into its own encoding, the data may be shared with other models
+        self.data = data.copy_encoding()
+        self.cache = cache
+        self.model_id = next_model_id()
+        self.version = 0  # changes with every update, so the cache does not return predictions of old tables
         self.classes = data.get_all_classes()
-        self.yes_class_ratio = (data.class_counter[self.classes[1]] / data.total_count)
-        self.no_class_ratio = (data.class_counter[self.classes[0]] / data.total_count)
+        classes_number = len(self.classes)
+        class_codes = [data.class_codes[class_type] for class_type in self.classes]
+        self.class_counts = array('q', (data.class_counter[class_type] for class_type in self.classes))
+
+        # count_tables[attribute index][value code * classes number + class index] is the count of value in the class
+        self.count_tables = []
+        if count_table is None:
+            count_table = data.count_table(data.get_all_attributes())
+        for attribute, codes in zip(data.get_all_attributes(), data.value_codes):
+            table = array('q', [0]) * (len(codes) * classes_number)
+            for code, class_counts in count_table[attribute].items():
+                for class_index, class_code in enumerate(class_codes):
+                    table[code * classes_number + class_index] = class_counts[class_code]
+            self.count_tables.append(table)
+
+        self._calc_value_totals()
+        self._calc_log_tables()
+
+    def _calc_value_totals(self):
+        """
+        Calculate the rows of every value from the count tables, and how many values of every attribute have rows.
+        Only those values are counted in the smoothing, so values without rows, that were never learned or were
+        forgotten, are like values the data never had.
+        :return: None.
+        """
+        classes_number = len(self.classes)
+        # value_totals[attribute index][value code] is the number of rows with the value
+        self.value_totals = [array('q', (sum(table[start:start + classes_number])
+                                         for start in range(0, len(table), classes_number)))
+                             for table in self.count_tables]
+        self.values_numbers = [sum(1 for total in totals if total) for totals in self.value_totals]
+
+    def _calc_log_tables(self):
+        """
+        Calculate the log tables from the count tables. With add one smoothing
+         log(P(value | class)) = log(count of value in class + 1) - log(class count + number of values of attribute),
+         so log_tables[attribute index][value code * classes number + class index] keeps the first part, and the
+         second part of all the attributes is summed with log(P(class)) into class_terms[class index].
+        A value the data never had has a count of 0, so it only has the class term.
+        :return: None.
+        """
+        self.log_tables = [array('d', (log(count + 1) for count in table)) for table in self.count_tables]
+        self._calc_class_terms()
+
+    def _calc_class_terms(self):
+        """
+        Calculate the class terms of the scores from the class counts, see _calc_log_tables.
+        :return: None.
+        """
+        total_count = sum(self.class_counts)
+        self.class_terms = array('d')
+
+        for class_count in self.class_counts:
+            if class_count == 0:
+                self.class_terms.append(float('-inf'))  # every row of the class was forgotten
+            else:
+                self.class_terms.append(log(class_count / total_count) - sum(log(class_count + values_number)
+                                                                             for values_number in self.values_numbers))
+
+    def partial_fit(self, rows):
+        """
+        Learn a batch of new rows, the cost depends only on the size of the batch. New values and classes are added to
+        the encoding of self.data, a copy that belongs to the model, and the rows are not stored.
+        :param rows: Lists of values in the order of the attributes of self.data, with the class last.
+        :return: None.
+        """
+        self._update(rows, 1)
+
+    def forget(self, rows):
+        """
+        Unlearn a batch of rows that were learned before, the cost depends only on the size of the batch.
+        :param rows: Lists of values in the order of the attributes of self.data, with the class last.
+        :return: None.
+        """
+        self._update(rows, -1)
+
+    def _update(self, rows, sign):
+        """
+        Add or remove the counts of a batch of rows, and update the log tables cells they touched.
+        :param rows: Lists of values with the class last.
+        :param sign: 1 to add the rows, -1 to remove them.
+        :return: None.
+        """
+        if not rows:
+            return
+        self.version += 1
+        columns = list(zip(*rows))
+        classes = columns.pop()
+        add_values = sign > 0
+        encoded_rows = self.data.encode_columns(self.data.attributes_names, columns, add_values=add_values)
+        class_codes = self.data.encode_classes(classes, add_values=add_values)
+
+        if not isinstance(self.class_counts, array):
+            self._copy_tables()  # the tables of a loaded model are read only memory maps
+        for class_type in dict.fromkeys(classes):
+            if class_type not in self.classes:
+                if not add_values:
+                    raise ValueError('can not forget class %s, it was never learned' % class_type)
+                self._add_class(class_type)
+        self._add_values()
+
+        classes_indexes = {self.data.class_codes[class_type]: i for i, class_type in enumerate(self.classes)}
+        classes_number = len(self.classes)
+        class_changes = Counter(classes_indexes[class_code] for class_code in class_codes)
+        cells_changes = Counter()
+        for codes, class_code in zip(encoded_rows, class_codes):
+            class_index = classes_indexes[class_code]
+            for attribute_index, code in enumerate(codes):
+                if code < 0:
+                    raise ValueError('can not forget a value of %s, it was never learned'
+                                     % self.data.attributes_names[attribute_index])
+                cells_changes[attribute_index, code * classes_number + class_index] += 1
+
+        if sign < 0:
+            if any(self.class_counts[i] < count for i, count in class_changes.items()) or \
+                    any(self.count_tables[a][cell] < count for (a, cell), count in cells_changes.items()):
+                raise ValueError('can not forget rows that were never learned')
+
+        for class_index, count in class_changes.items():
+            self.class_counts[class_index] += sign * count
+        for (attribute_index, cell), count in cells_changes.items():
+            self.count_tables[attribute_index][cell] += sign * count
+            self.log_tables[attribute_index][cell] = log(self.count_tables[attribute_index][cell] + 1)
+            totals = self.value_totals[attribute_index]
+            code = cell // classes_number
+            had_rows = totals[code] != 0
+            totals[code] += sign * count
+            if had_rows != (totals[code] != 0):
+                self.values_numbers[attribute_index] += 1 if totals[code] else -1
+        self._calc_class_terms()
+
+    def _copy_tables(self):
+        """
+        Copy the tables into arrays that can be changed.
+        :return: None.
+        """
+        self.class_counts = array('q', self.class_counts)
+        self.count_tables = [array('q', table) for table in self.count_tables]
+        self.log_tables = [array('d', table) for table in self.log_tables]
+
+    def _add_class(self, class_type):
+        """
+        Add a class without rows, the tables are rebuilt for the new number of classes.
+        :param class_type: The class.
+        :return: None.
+        """
+        classes_number = len(self.classes)
+        self.classes.append(class_type)
+        self.class_counts.append(0)
+        for i, table in enumerate(self.count_tables):
+            new_table = array('q')
+            for start in range(0, len(table), classes_number):
+                new_table.extend(table[start:start + classes_number])
+                new_table.append(0)
+            self.count_tables[i] = new_table
+        self._calc_log_tables()
+
+    def _add_values(self):
+        """
+        Extend the tables for the values that were added to the encoding of self.data, their counts are 0.
+        :return: None.
+        """
+        classes_number = len(self.classes)
+        for attribute_index, codes in enumerate(self.data.value_codes):
+            missing = len(codes) * classes_number - len(self.count_tables[attribute_index])
+            if missing > 0:
+                self.count_tables[attribute_index].extend([0] * missing)
+                self.log_tables[attribute_index].extend([0.0] * missing)
+                self.value_totals[attribute_index].extend([0] * (missing // classes_number))
+
+    def save(self, file_path):
+        """
+        Save the count and log tables in a binary model file.
+        :param file_path: The path of the file.
+        :return: None.
+        """
+        arrays = {'class_counts': self.class_counts, 'class_terms': self.class_terms}
+        for i, (count_table, log_table) in enumerate(zip(self.count_tables, self.log_tables)):
+            arrays['count_table%d' % i] = count_table
+            arrays['log_table%d' % i] = log_table
+        write_model(file_path, 'NaiveBayes', {'encoding': self.data.get_encoding(), 'classes': self.classes}, arrays)
+
+    @staticmethod
+    def load(file_path):
+        """
+        Load a naive bayes saved by save, the tables are memory mapped. It can predict but it has no data rows.
+        :param file_path: The path of the file.
+        :return: The naive bayes.
+        """
+        header, arrays = read_model(file_path, 'NaiveBayes')
+        naive_bayes = NaiveBayes.__new__(NaiveBayes)
+        naive_bayes.data = DataObject.from_encoding(header['encoding'])
+        naive_bayes.cache = shared_cache
+        naive_bayes.model_id = next_model_id()
+        naive_bayes.version = 0
+        naive_bayes.classes = header['classes']
+        naive_bayes.class_counts = arrays['class_counts']
+        naive_bayes.class_terms = arrays['class_terms']
+        attributes_number = len(naive_bayes.data.attributes_names)
+        naive_bayes.count_tables = [arrays['count_table%d' % i] for i in range(attributes_number)]
+        naive_bayes.log_tables = [arrays['log_table%d' % i] for i in range(attributes_number)]
+        naive_bayes._calc_value_totals()
+        return naive_bayes
 
     def predict(self, entry):
         """
@@ -15,17 +234,67 @@ class NaiveBayes(object):
         :param entry: The entry to do prediction on.
         :return: The prediction.
         """
-        yes_probability = self.yes_class_ratio
-        no_probability = self.no_class_ratio
+        return self.predict_codes(self.data.encode_entry(entry))
 
-        for attribute, value in zip(entry.attributes_names, entry.attributes):
-            yes_probability *= self.calc_probability(attribute, value, self.classes[1])
-            no_probability *= self.calc_probability(attribute, value, self.classes[0])
+    def predict_batch(self, rows):
+        """
+        Predict many encoded rows, every distinct row is scored only once.
+        :param rows: Codes tuples in the order of the attributes of self.data, see DataObject.encode_rows.
+        :return: List of the predictions.
+        """
+        predictions = {}
+        for row in rows:
+            if row not in predictions:
+                predictions[row] = self.predict_codes(row)
+        return [predictions[row] for row in rows]
 
-        if yes_probability > no_probability:
-            return self.classes[1]
-        else:
-            return self.classes[0]
+    def predict_codes(self, codes):
+        """
+        Predict the class for encoded values, repeated queries are answered from the cache.
+        :param codes: The codes of the values, -1 for a value the data never had.
+        :return: The prediction.
+        """
+        if self.cache is None:
+            return self._predict_codes(codes)
+        return self.cache.predict(self, tuple(codes), self._predict_codes)
+
+    def _predict_codes(self, codes):
+        """
+        Predict the class for encoded values from the scores.
+        :param codes: The codes of the values.
+        :return: The prediction.
+        """
+        scores = self.calc_scores(codes)
+        # max keeps the first class on equality, like choosing classes[0] when the probabilities are equal
+        best_class_index = max(range(len(self.classes)), key=scores.__getitem__)
+        return self.classes[best_class_index]
+
+    def predict_many(self, entries):
+        """
+        Calculate the scores of many entries.
+        :param entries: The entries to score.
+        :return: Score matrix, a row of log probabilities for every entry, ordered like self.classes.
+        """
+        return [self.calc_scores(self.data.encode_entry(entry)) for entry in entries]
+
+    def calc_scores(self, codes):
+        """
+        Calculate the log probability of every class for encoded values.
+        :param codes: The codes of the values, -1 for a value the data never had.
+        :return: List of log probabilities, ordered like self.classes.
+        """
+        if instrumentation.enabled:
+            instrumentation.count('naive_bayes.scored_rows')
+        scores = list(self.class_terms)
+        classes_number = len(scores)
+
+        for log_table, code in zip(self.log_tables, codes):
+            start = code * classes_number
+            if 0 <= start < len(log_table):
+                for i, log_probability in enumerate(log_table[start:start + classes_number]):
+                    scores[i] += log_probability
+
+        return scores
 
     def calc_probability(self, attribute, value, class_type):
         """
@@ -35,19 +304,13 @@ class NaiveBayes(object):
         :param class_type: The class type.
         :return: The probability.
         """
-        attribute_count = 1  # starts at 1 in order to avoid 0 mul
-
-        for entry in self.data.get_all_entries():
-            if entry.entry_class == class_type:
-                if entry.has_attribute(attribute, value):
-                    attribute_count += 1
-
-        smoothing_denominator = len(self.data.dict_of_attributes[attribute])
-
-        if class_type == self.classes[1]:
-            return attribute_count / (self.data.class_counter[self.classes[1]] + smoothing_denominator)
-        elif class_type == self.classes[0]:
-            return attribute_count / (self.data.class_counter[self.classes[0]] + smoothing_denominator)
+        attribute_index = self.data.attributes_indexes[attribute]
+        code = self.data.encode_value(attribute, value)
+        class_index = self.classes.index(class_type)
+        count_table = self.count_tables[attribute_index]
+        values_number = len(count_table) // len(self.classes)
+        count = count_table[code * len(self.classes) + class_index] if 0 <= code < values_number else 0
+        return (count + 1) / (self.class_counts[class_index] + self.values_numbers[attribute_index])
 
     def __repr__(self):
         """
@@ -0,0 +1,108 @@
+from collections import OrderedDict
+from itertools import count
+from threading import Lock
+
+_model_ids = count()
+_MISSING = object()  # not in the cache, unlike a cached prediction of None
+
+
+def next_model_id():
+    """
+    Return a new id for a model, unlike id() it is never reused by another model.
+    :return: The id.
+    """
+    return next(_model_ids)
+
+
+class PredictionCache(object):
+
+    def __init__(self, max_size=4096):
+        """
+        Construct a bounded cache of predictions, when it is full the least recently used prediction is evicted.
+        The predictions are keyed by the model id, the model version and the codes of the query, a model changes
+        its version when it is trained again, so its old predictions are never used and are evicted in time.
+        :param max_size: The maximal number of predictions.
+        """
+        self.max_size = max_size
+        self._predictions = OrderedDict()  # {(model id, model version, codes): prediction}, the most recent last
+        self._lock = Lock()  # the driver predicts with some models in threads
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def predict(self, model, codes, compute):
+        """
+        Return the prediction of a model for codes, compute it only if it is not in the cache.
+        :param model: The model, with model_id and version.
+        :param codes: Tuple of the codes of the values.
+        :param compute: Function from the codes to the prediction.
+        :return: The prediction.
+        """
+        key = (model.model_id, model.version, codes)
+        with self._lock:
+            prediction = self._predictions.get(key, _MISSING)
+            if prediction is not _MISSING:
+                self._predictions.move_to_end(key)
+                self.hits += 1
+                return prediction
+            self.misses += 1
+
+        prediction = compute(codes)
+        with self._lock:
+            self._predictions[key] = prediction
+            while len(self._predictions) > self.max_size:
+                self._predictions.popitem(last=False)
+                self.evictions += 1
+        return prediction
+
+    def __getstate__(self):
+        """
+        Pickle the cache without its lock, for models that are sent to other processes.
+        :return: The state.
+        """
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        """
+        Unpickle the cache with a new lock.
+        :param state: The state.
+        :return: None.
+        """
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    def stats(self):
+        """
+        Return the statistics of the cache.
+        :return: {'hits': .., 'misses': .., 'evictions': .., 'size': .., 'max_size': ..}.
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'size': len(self._predictions), 'max_size': self.max_size}
+
+    def add_stats(self, hits, misses, evictions):
+        """
+        Add the statistics of a copy of the cache, like the one of a model that predicted in another process.
+        :param hits: The hits of the copy.
+        :param misses: The misses of the copy.
+        :param evictions: The evictions of the copy.
+        :return: None.
+        """
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.evictions += evictions
+
+    def clear(self):
+        """
+        Remove all the predictions and reset the statistics.
+        :return: None.
+        """
+        with self._lock:
+            self._predictions.clear()
+            self.hits = self.misses = self.evictions = 0
+
+
+# the cache of all the models, unless a model is given another one
+shared_cache = PredictionCache()
@@ -0,0 +1,311 @@
+import asyncio
+import json
+import time
+from collections import deque
+
+from data_loader import load_data
+from id3_algorithm import ID3
+from instrumentation import percentile
+from knn_algo import Knn
+from naive_bayes_algorithm import NaiveBayes
+
+LATENCIES_KEPT = 10000  # the latencies of the last requests, for the percentiles
+
+
+class MicroBatcher(object):
+
+    def __init__(self, model, max_batch=64, max_wait=0.002):
+        """
+        Construct a batcher that gathers the requests of a model and predicts them together with predict_batch.
+        A batch is predicted when it has max_batch rows or max_wait seconds after its first row came.
+        :param model: The model, with data and predict_batch.
+        :param max_batch: The maximal number of rows of a batch.
+        :param max_wait: How many seconds the first row of a batch may wait for more rows.
+        """
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches_number = 0
+        self.rows_number = 0
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        """
+        Start predicting the batches, in the running event loop.
+        :return: None.
+        """
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop predicting, the rows that wait are cancelled.
+        :return: None.
+        """
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def predict(self, values):
+        """
+        Predict one row, with the other rows of its batch.
+        :param values: The values of the row, in the order of the attributes of the model.
+        :return: The prediction.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((values, future))
+        return await future
+
+    async def _run(self):
+        """
+        Take batches from the queue and predict them, until cancelled.
+        :return: None.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                # the prediction runs in a thread, so the loop keeps reading requests meanwhile
+                predictions = await loop.run_in_executor(None, self._predict_batch, [values for values, _ in batch])
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            self.batches_number += 1
+            self.rows_number += len(batch)
+            for (_, future), prediction in zip(batch, predictions):
+                if not future.done():
+                    future.set_result(prediction)
+
+    def _predict_batch(self, rows):
+        """
+        Encode and predict a batch of rows.
+        :param rows: The values of the rows.
+        :return: List of the predictions.
+        """
+        data = self.model.data
+        return self.model.predict_batch(data.encode_rows(data.attributes_names, rows))
+
+
+class PredictionServer(object):
+
+    def __init__(self, models, max_batch=64, max_wait=0.002):
+        """
+        Construct a scoring service for trained models, on a line protocol:
+         a request is a line of the tab separated values of a row, in the order of the attributes of the models, and
+         its response is a line of the tab separated predictions of the models, or ERROR and a message.
+         The line STATS gets a line of the metrics as json, see stats.
+        :param models: The trained models, they must have the same attributes.
+        :param max_batch: The maximal number of rows of a batch, see MicroBatcher.
+        :param max_wait: How many seconds the first row of a batch may wait for more rows.
+        """
+        self.models = models
+        self.attributes_number = len(models[0].data.attributes_names)
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batchers = []
+        self.latencies = deque(maxlen=LATENCIES_KEPT)
+        self.requests_number = 0
+        self.errors_number = 0
+        self.start_time = None
+        self._server = None
+
+    async def start(self, host='127.0.0.1', port=8642):
+        """
+        Start listening, in the running event loop.
+        :param host: The host.
+        :param port: The port, 0 for any free port.
+        :return: The port.
+        """
+        self.batchers = [MicroBatcher(model, self.max_batch, self.max_wait) for model in self.models]
+        for batcher in self.batchers:
+            batcher.start()
+        self.start_time = time.perf_counter()
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """
+        Stop listening and predicting.
+        :return: None.
+        """
+        self._server.close()
+        await self._server.wait_closed()
+        for batcher in self.batchers:
+            await batcher.stop()
+
+    def stats(self):
+        """
+        Return the metrics of the service.
+        :return: {'requests': .., 'errors': .., 'requests_per_second': .., 'latency_seconds': {'p50': .., 'p99': ..},
+         'mean_batch_size': {model: ..}}.
+        """
+        latencies = sorted(self.latencies)
+        uptime = time.perf_counter() - self.start_time if self.start_time is not None else 0
+        return {'requests': self.requests_number, 'errors': self.errors_number,
+                'requests_per_second': self.requests_number / uptime if uptime else 0,
+                'latency_seconds': {'p%d' % percent: percentile(latencies, percent) if latencies else None
+                                    for percent in (50, 99)},
+                'mean_batch_size': {str(batcher.model): batcher.rows_number / batcher.batches_number
+                                    if batcher.batches_number else 0 for batcher in self.batchers}}
+
+    async def _handle_connection(self, reader, writer):
+        """
+        Answer the requests of a connection, in their order, until it is closed.
+        :param reader: The stream reader.
+        :param writer: The stream writer.
+        :return: None.
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                writer.write((await self._respond(line.decode('utf-8').strip('\r\n')) + '\n').encode('utf-8'))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, line):
+        """
+        Build the response of a request line.
+        :param line: The line, without the new line.
+        :return: The response, without the new line.
+        """
+        if line == 'STATS':
+            return json.dumps(self.stats())
+
+        start = time.perf_counter()
+        values = line.split('\t')
+        if len(values) != self.attributes_number:
+            self.errors_number += 1
+            return 'ERROR expected %d values, got %d' % (self.attributes_number, len(values))
+        try:
+            predictions = await asyncio.gather(*(batcher.predict(values) for batcher in self.batchers))
+        except Exception as error:
+            self.errors_number += 1
+            return 'ERROR %s' % error
+        self.requests_number += 1
+        self.latencies.append(time.perf_counter() - start)
+        return '\t'.join(str(prediction) for prediction in predictions)
+
+
+def train_models(file_path, k=5):
+    """
+    Train ID3, KNN and Naive Bayes on a tab separated file, like py_ex2.py does.
+    :param file_path: The path of the train file.
+    :param k: The k of KNN.
+    :return: List of the models.
+    """
+    data = load_data(file_path)
+    id3 = ID3(data)
+    default = max(data.class_counter.items(), key=lambda x: x[1])[0]
+    id3.generate_tree(data, attributes=data.get_all_attributes(), default=default)
+    return [id3, Knn(data=data, k=k), NaiveBayes(data)]
+
+
+async def generate_load(host, port, rows, requests_number, concurrency=16):
+    """
+    Send requests to a server from some connections at once, every connection waits for a response before its next
+    request.
+    :param host: The host of the server.
+    :param port: The port of the server.
+    :param rows: The values of the rows to send, they are sent in turns.
+    :param requests_number: The number of requests to send.
+    :param concurrency: The number of connections.
+    :return: {'requests': .., 'errors': .., 'requests_per_second': .., 'latency_seconds': {'p50': .., 'p99': ..}},
+     the latencies are measured by the clients.
+    """
+    latencies = []
+    errors = [0]
+
+    async def client(first_request):
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for request in range(first_request, requests_number, concurrency):
+                start = time.perf_counter()
+                writer.write(('\t'.join(rows[request % len(rows)]) + '\n').encode('utf-8'))
+                await writer.drain()
+                response = await reader.readline()
+                latencies.append(time.perf_counter() - start)
+                if not response or response.startswith(b'ERROR'):
+                    errors[0] += 1
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(concurrency)))
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    return {'requests': requests_number, 'errors': errors[0], 'requests_per_second': requests_number / seconds,
+            'latency_seconds': {'p%d' % percent: percentile(latencies, percent) if latencies else None
+                                for percent in (50, 99)}}
+
+
+async def _serve(models, host, port, max_batch, max_wait):
+    """
+    Run a server until it is interrupted.
+    :return: None.
+    """
+    server = PredictionServer(models, max_batch, max_wait)
+    port = await server.start(host, port)
+    print('serving %s on %s:%d' % (', '.join(str(model) for model in models), host, port))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == '__main__':
+    """
+    Serve the models, trained on train.txt or loaded from model files, or send load to a running server:
+     python prediction_server.py serve [--id3 FILE --knn FILE --naive-bayes FILE]
+     python prediction_server.py load --requests 10000
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve predictions of ID3, KNN and Naive Bayes on a local socket.')
+    parser.add_argument('command', choices=('serve', 'load'))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8642)
+    parser.add_argument('--train', default='train.txt', help='the train file, when no model files are given')
+    parser.add_argument('--id3', help='a model file saved by ID3.save')
+    parser.add_argument('--knn', help='a model file saved by Knn.save')
+    parser.add_argument('--naive-bayes', help='a model file saved by NaiveBayes.save')
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-wait', type=float, default=0.002, help='seconds')
+    parser.add_argument('--test', default='test.txt', help='the rows the load generator sends')
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    arguments = parser.parse_args()
+
+    if arguments.command == 'serve':
+        loaded_models = [model_class.load(file_path) for model_class, file_path in
+                         ((ID3, arguments.id3), (Knn, arguments.knn), (NaiveBayes, arguments.naive_bayes))
+                         if file_path]
+        try:
+            asyncio.run(_serve(loaded_models or train_models(arguments.train), arguments.host, arguments.port,
+                               arguments.max_batch, arguments.max_wait))
+        except KeyboardInterrupt:
+            pass
+    else:
+        test_data = load_data(arguments.test)
+        test_rows = [test_data.get_entry(row).attributes for row in range(test_data.total_count)]
+        load_results = asyncio.run(generate_load(arguments.host, arguments.port, test_rows, arguments.requests,
+                                                 arguments.concurrency))
+        print(json.dumps(load_results, indent=2))
@@ -1,7 +1,19 @@
-from data_object import DataObject, Entry
+import os
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from itertools import chain
+
+from data_loader import iter_column_batches, load_data
 from id3_algorithm import ID3
+from instrumentation import instrumentation, profile
 from knn_algo import Knn
 from naive_bayes_algorithm import NaiveBayes
+from prediction_cache import shared_cache
+from random_forest import RandomForest
+
+PROCESS_MIN_ROWS = 256  # the smallest part of a chunk that is sent to a process
 
 
 def load_train_data():
@@ -9,92 +21,306 @@ def load_train_data():
     Loads the data from the train.txt file
     :return: the data object of the training files.
     """
-    data = DataObject()
+    return load_data('train.txt')
 
-    with open('train.txt', 'r') as train_file:
-        headers = train_file.readline().strip().split('\t')
 
-        for line in train_file:
-            entry = Entry(headers[:-1], *line.strip().split('\t'))
-            data.add_entry(entry)
-
-        return data
+def write_output_header(output_file, algorithms):
+    """
+    Write the header line of the output.
+    :param output_file: The opened output file.
+    :param algorithms: The algorithms, a column for each one.
+    :return: None.
+    """
+    header = 'Num'
+    for algorithm in algorithms:
+        header += '\t%s' % str(algorithm)
+    output_file.write(header + '\n')
 
 
-def write_output_file(all_predictions, success_ratios, algorithms):
+def write_output_lines(output_file, predictions, first_number):
     """
-    Write the output
-    :param all_predictions:
-    :param success_ratios:
-    :param algorithms:
-    :return:
+    Write the predictions of a batch of tests.
+    :param output_file: The opened output file.
+    :param predictions: A tuple of the predictions of all the algorithms for every test.
+    :param first_number: The number of the first test of the batch.
+    :return: None.
     """
-    with open('output.txt', 'w') as output_file:
-        header = 'Num'
-        for algorithm in algorithms:
-            header += '\t%s' % str(algorithm)
-        output_file.write(header + '\n')
+    data_to_output = []
+    for prediction_number, prediction in enumerate(predictions, first_number):
+        line = '%d' % prediction_number
+        for algorithm_prediction in prediction:
+            line += '\t%s' % algorithm_prediction
+        data_to_output.append(line + '\n')
+    output_file.writelines(data_to_output)
 
-        data_to_output = []
-        for prediction_number, prediction in enumerate(all_predictions):
-            line = '%d' % (prediction_number + 1)
-            for algorithm_prediction in prediction:
-                line += '\t%s' % algorithm_prediction
-            data_to_output.append(line + '\n')
 
-        line = ''
-        for success_ratio in success_ratios:
-            line += '\t%.2f' % success_ratio
-        data_to_output.append(line)
-        output_file.writelines(data_to_output)
+def write_output_footer(output_file, success_ratios):
+    """
+    Write the success ratio of every algorithm as the last line.
+    :param output_file: The opened output file.
+    :param success_ratios: The success ratios.
+    :return: None.
+    """
+    line = ''
+    for success_ratio in success_ratios:
+        line += '\t%.2f' % success_ratio
+    output_file.write(line)
 
 
-def write_predictions_to_file(*algorithms):
+def write_predictions_to_file(*algorithms, workers=None, queue_size=4):
     """
     Write the predictions of test.txt in output.txt
+    test.txt is read in chunks and all the algorithms predict a chunk concurrently: KNN, the CPU bound one, in a pool
+    of processes with the chunk split between them, and the others in threads. A writer thread takes the chunks from
+    a bounded queue in their order and writes their lines while the next chunks are predicted.
+    The counters and the cache statistics of the processes are merged into those of this process.
     :param algorithms: List of prediction algorithms to use.
+    :param workers: The number of processes, None for the number of cpus. With one, KNN runs in a thread too. No more
+     processes are started than the parts of the first chunk, so a small test file does not start idle processes.
+    :param queue_size: How many chunks may wait for the writer before reading stops.
     :return: None.
     """
-    algorithms_success = [0 for _ in range(len(algorithms))]
-    all_predictions = []
+    workers = workers or os.cpu_count() or 1
+    # with one cpu a process would only add the cost of sending the rows
+    process_algorithms = {i: algorithm for i, algorithm in enumerate(algorithms)
+                          if isinstance(algorithm, Knn) and workers > 1}
+    batches = queue.Queue(queue_size)
+    # test.txt is opened, and its first chunk read, before output.txt is truncated
+    chunks = iter_column_batches('test.txt')
+    first_chunk = next(chunks, None)
 
-    with open('test.txt', 'r') as test_file:
-        total_tests = 0
-        headers = test_file.readline().strip().split('\t')
+    with open('output.txt', 'w') as output_file, ExitStack() as stack:
+        write_output_header(output_file, algorithms)
+        threads = stack.enter_context(ThreadPoolExecutor(len(algorithms) + 1))
+        processes = None
+        writer = threads.submit(_write_batches, output_file, batches, algorithms)
 
-        for line in test_file:
-            entry = Entry(headers, *line.strip().split('\t'))
-            total_tests += 1
-            test_predictions = []
+        try:
+            for headers, columns in chain([first_chunk] if first_chunk else [], chunks):
+                algorithms_futures = []
+                for i, predictions_algorithm in enumerate(algorithms):
+                    if i in process_algorithms:
+                        encoded_rows = predictions_algorithm.data.encode_columns(headers, columns)
+                        parts = _split_batch(encoded_rows, workers)
+                        if processes is None:
+                            # the first chunk is the biggest, it has the most parts
+                            processes = stack.enter_context(ProcessPoolExecutor(
+                                len(parts), initializer=_init_worker,
+                                initargs=(process_algorithms, instrumentation.enabled)))
+                        algorithms_futures.append([processes.submit(_predict_in_worker, i, part) for part in parts])
+                    else:
+                        algorithms_futures.append([threads.submit(_predict_columns, predictions_algorithm,
+                                                                  headers, columns)])
+                _put_batch(batches, (columns[-1], algorithms_futures), writer)
+        finally:
+            # the writer waits for the end of the batches also when reading or predicting failed
+            _stop_writer(batches, writer)
+        success_ratios = writer.result()
+        write_output_footer(output_file, success_ratios)
 
-            for i, predictions_algorithm in enumerate(algorithms):
-                prediction = predictions_algorithm.predict(entry)
-                if prediction == entry.entry_class:
-                    algorithms_success[i] += 1
-                test_predictions.append(prediction)
-            all_predictions.append(test_predictions)
 
-    success_ratios = [x / total_tests for x in algorithms_success]
-    write_output_file(all_predictions, success_ratios, algorithms)
+def _predict_columns(algorithm, headers, columns):
+    """
+    Predict a chunk of test rows.
+    :param algorithm: The prediction algorithm.
+    :param headers: The headers of the columns.
+    :param columns: The values of the chunk, column by column.
+    :return: (list of the predictions, seconds of the prediction, None as no other process predicted them).
+    """
+    encoded_rows = algorithm.data.encode_columns(headers, columns)
+    start = time.perf_counter()
+    predictions = algorithm.predict_batch(encoded_rows)
+    return predictions, time.perf_counter() - start, None
 
 
-if __name__ == '__main__':
+def _split_batch(rows, parts_number):
     """
-    Load train data, run predictions on test.txt with KNN, ID3 and Naive Bayes. Then save them in output.txt
+    Split encoded rows into at most parts_number parts of at least PROCESS_MIN_ROWS rows, in their order.
+    :param rows: The rows.
+    :param parts_number: The maximal number of parts.
+    :return: List of the parts.
     """
-    import time
+    parts_number = max(1, min(parts_number, len(rows) // PROCESS_MIN_ROWS))
+    part_size = -(-len(rows) // parts_number)
+    return [rows[i:i + part_size] for i in range(0, len(rows), part_size)] or [rows]
 
-    start = time.time()
-    data_object = load_train_data()
+
+def _put_batch(batches, batch, writer):
+    """
+    Put a batch in the queue of the writer, waiting while it is full.
+    :param batches: The queue.
+    :param batch: The batch.
+    :param writer: The future of the writer, if it failed its error is raised instead of waiting forever.
+    :return: None.
+    """
+    while True:
+        try:
+            batches.put(batch, timeout=0.1)
+            return
+        except queue.Full:
+            if writer.done():
+                writer.result()
+                raise RuntimeError('the writer stopped before the end of the predictions')
+
+
+def _stop_writer(batches, writer):
+    """
+    Put the end of the batches in the queue of the writer, unless the writer already stopped. It does not raise, so
+    an error that stopped the reading is the one that is raised.
+    :param batches: The queue.
+    :param writer: The future of the writer.
+    :return: None.
+    """
+    while not writer.done():
+        try:
+            batches.put(None, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def _write_batches(output_file, batches, algorithms):
+    """
+    Write the lines of the batches of the queue in their order, until it gets None. The time of every part is added to
+    the timer of its algorithm with its rows, so the report has the latency per row.
+    :param output_file: The opened output file.
+    :param batches: Queue of (test classes, [futures of the parts of every algorithm, see _predict_columns]).
+    :param algorithms: The algorithms.
+    :return: The success ratio of every algorithm.
+    """
+    algorithms_success = [0 for _ in algorithms]
+    total_tests = 0
+
+    while True:
+        batch = batches.get()
+        if batch is None:
+            break
+        test_classes, algorithms_futures = batch
+        algorithms_predictions = []
+
+        for i, futures in enumerate(algorithms_futures):
+            predictions = []
+            for future in futures:
+                part_predictions, seconds, worker_stats = future.result()
+                predictions.extend(part_predictions)
+                if instrumentation.enabled:
+                    instrumentation.add_time('predict %s' % algorithms[i], seconds, len(part_predictions))
+                if worker_stats is not None:
+                    _merge_worker_stats(algorithms[i], *worker_stats)
+            instrumentation.count('predict %s rows' % algorithms[i], len(predictions))
+            algorithms_predictions.append(predictions)
+            algorithms_success[i] += sum(1 for prediction, test_class in zip(predictions, test_classes)
+                                         if prediction == test_class)
+
+        write_output_lines(output_file, zip(*algorithms_predictions), total_tests + 1)
+        total_tests += len(test_classes)
+
+    return [x / total_tests for x in algorithms_success]
+
+
+# the algorithms of a process of the pool, by their index in write_predictions_to_file
+_worker_algorithms = None
+
+
+def _init_worker(algorithms, instrumented):
+    """
+    Keep the algorithms in a process of the pool, so they are sent once and not with every batch.
+    :param algorithms: {index: algorithm}.
+    :param instrumented: True to count in the process too, the counts are sent back with the predictions.
+    :return: None.
+    """
+    global _worker_algorithms
+    _worker_algorithms = algorithms
+    if instrumented:
+        instrumentation.enable()
+
+
+def _predict_in_worker(index, rows):
+    """
+    Predict encoded rows in a process of the pool.
+    :param index: The index of the algorithm.
+    :param rows: The encoded rows.
+    :return: (list of the predictions, seconds of the prediction, (the counters of the prediction, the hits, misses
+     and evictions of the cache of the algorithm)), see _merge_worker_stats.
+    """
+    algorithm = _worker_algorithms[index]
+    cache = algorithm.cache
+    cache_before = (cache.hits, cache.misses, cache.evictions) if cache is not None else (0, 0, 0)
+    start = time.perf_counter()
+    predictions = algorithm.predict_batch(rows)
+    seconds = time.perf_counter() - start
+    cache_after = (cache.hits, cache.misses, cache.evictions) if cache is not None else (0, 0, 0)
+    # the counters of this call only, the process predicts other parts later
+    counters, instrumentation.counters = instrumentation.counters, {}
+    return predictions, seconds, (counters, [after - before for before, after in zip(cache_before, cache_after)])
+
+
+def _merge_worker_stats(algorithm, counters, cache_changes):
+    """
+    Add what a process of the pool counted while it predicted a part to the counters and to the cache of this process.
+    :param algorithm: The algorithm of this process that the part was predicted with.
+    :param counters: {name: count} of the process.
+    :param cache_changes: The hits, misses and evictions of the cache of the process.
+    :return: None.
+    """
+    for name, amount in counters.items():
+        instrumentation.count(name, amount)
+    if algorithm.cache is not None:
+        algorithm.cache.add_stats(*cache_changes)
+
+
+def run(forest_trees=0):
+    """
+    Load train data, run predictions on test.txt with KNN, ID3 and Naive Bayes. Then save them in output.txt
+    Every phase is timed when the instrumentation is enabled.
+    :param forest_trees: The number of trees of a random forest to predict with too, 0 for no random forest.
+    :return: None.
+    """
+    with instrumentation.timer('load train data'):
+        data_object = load_train_data()
 
     # create 3 prediction algorithms
     id3 = ID3(data_object)
     default = max(data_object.class_counter.items(), key=lambda x: x[1])[0]
-    id3.generate_tree(data_object, attributes=data_object.get_all_attributes(), default=default)
+    with instrumentation.timer('ID3 generate tree'):
+        id3.generate_tree(data_object, attributes=data_object.get_all_attributes(), default=default)
     id3.write_tree_to_file()
-    knn = Knn(data=data_object, k=5)
-    naive_bayes = NaiveBayes(data_object)
+    with instrumentation.timer('KNN build'):
+        knn = Knn(data=data_object, k=5)
+    with instrumentation.timer('Naive Bayes build'):
+        naive_bayes = NaiveBayes(data_object)
+    algorithms = [id3, knn, naive_bayes]
+    if forest_trees:
+        with instrumentation.timer('random forest build'):
+            algorithms.append(RandomForest(data_object, trees_number=forest_trees, seed=0))
+
+    with instrumentation.timer('write predictions'):
+        write_predictions_to_file(*algorithms)
 
-    write_predictions_to_file(id3, knn, naive_bayes)
+
+if __name__ == '__main__':
+    """
+    Run the predictions and print the time. --report prints the counters and the timers of the phases and the
+    statistics of the prediction cache, --profile saves a cProfile stats file of the run.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Predict test.txt with ID3, KNN and Naive Bayes.')
+    parser.add_argument('--report', action='store_true', help='print the counters and timers of the run')
+    parser.add_argument('--profile', metavar='FILE', help='save the cProfile stats of the run in FILE')
+    parser.add_argument('--forest', type=int, default=0, metavar='TREES',
+                        help='add a column of a random forest of TREES trees')
+    arguments = parser.parse_args()
+
+    if arguments.report:
+        instrumentation.enable()
+    start = time.time()
+    if arguments.profile:
+        profile(run, arguments.profile, arguments.forest)
+    else:
+        run(arguments.forest)
     end = time.time()
     print(end - start)
+    if arguments.report:
+        print(instrumentation.report(), end='')
+        print('prediction cache: %s' % shared_cache.stats())
@@ -0,0 +1,155 @@
+import os
+import random
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from math import sqrt
+
+from attribute_node import CompiledTree
+from data_object import DataView, attach_shared_data, most_common_class, shared_data
+from id3_algorithm import ID3
+from prediction_cache import next_model_id, shared_cache
+
+
+class RandomForest(object):
+
+    def __init__(self, data, trees_number=10, max_features=None, seed=None, workers=None, cache=shared_cache,
+                 **options):
+        """
+        Construct a bagged ensemble of ID3 trees and train it: every tree is generated on a bootstrap sample of the
+        rows, a view that draws the rows with repetition, and every node of it chooses from max_features attributes
+        drawn at random. The trees are trained in a pool of processes that read the rows from shared memory, only
+        their compiled arrays come back. A prediction is the majority vote of the trees.
+        :param data: The data we have as training examples, a data object or a view.
+        :param trees_number: The number of trees.
+        :param max_features: The number of attributes drawn for every node, None for the square root of the number of
+         attributes.
+        :param seed: The seed of the samples and the draws, the trees are the same for any number of workers.
+        :param workers: The number of processes, None for the number of cpus. With one, everything runs here.
+        :param cache: The prediction cache of predict and predict_codes, None to not cache the predictions.
+        :param options: More options of the trees, see ID3.
+        """
+        if data.total_count == 0:
+            raise ValueError('can not train a random forest without rows')
+        if max_features is None:
+            max_features = max(1, round(sqrt(len(data.attributes_names))))
+        self.data = data
+        self.trees_number = trees_number
+        self.max_features = max_features
+        self.seed = seed
+        self.options = dict(options, max_features=max_features)
+        self.cache = cache
+        self.model_id = next_model_id()
+        self.version = 0
+        self.trees = self._train(workers)
+
+    def _train(self, workers):
+        """
+        Train the trees.
+        :param workers: The number of processes, None for the number of cpus.
+        :return: List of the compiled trees.
+        """
+        generator = random.Random(self.seed)
+        seeds = [generator.getrandbits(32) for _ in range(self.trees_number)]
+        source = self.data.get_source()
+        rows = None if source is self.data else self.data.get_rows()
+        workers = min(workers or os.cpu_count() or 1, self.trees_number)
+
+        if workers == 1:
+            results = [_train_tree(source, rows, self.options, tree_seed) for tree_seed in seeds]
+        else:
+            with shared_data(source) as shared, ProcessPoolExecutor(workers, initializer=_init_worker,
+                                                                    initargs=(shared, rows, self.options)) as pool:
+                results = list(pool.map(_train_tree_in_worker, seeds))
+
+        self.version += 1
+        return [CompiledTree.from_arrays(classes, arrays) for classes, arrays in results]
+
+    def predict(self, entry):
+        """
+        Predict the class of an entry.
+        :param entry: Entry to predict.
+        :return: The prediction.
+        """
+        return self.predict_codes(self.data.encode_entry(entry))
+
+    def predict_codes(self, codes):
+        """
+        Predict the class for encoded values, repeated queries are answered from the cache.
+        :param codes: The codes of the values, -1 for a value the data never had.
+        :return: The prediction.
+        """
+        codes = tuple(codes)
+        if self.cache is None:
+            return self.predict_batch([codes])[0]
+        return self.cache.predict(self, codes, lambda row: self.predict_batch([row])[0])
+
+    def predict_batch(self, rows):
+        """
+        Predict many encoded rows: every tree predicts the distinct rows in one batch, then every row takes the vote of
+        its column of predictions.
+        :param rows: Codes tuples in the order of the attributes of self.data, see DataObject.encode_rows.
+        :return: List of the predictions.
+        """
+        distinct_rows = list(dict.fromkeys(rows))
+        trees_predictions = [tree.predict_batch(distinct_rows) for tree in self.trees]
+        predictions = {row: most_common_class(Counter(votes))
+                       for row, votes in zip(distinct_rows, zip(*trees_predictions))}
+        return [predictions[row] for row in rows]
+
+    def __repr__(self):
+        """
+        Representation for the random forest.
+        :return: String of representation.
+        """
+        return 'RF'
+
+
+def _train_tree(data, rows, options, seed):
+    """
+    Generate a tree on a bootstrap sample of rows and compile it.
+    :param data: The data object that holds the rows.
+    :param rows: The rows to sample from, None for all the rows of data.
+    :param options: The options of the tree, see ID3.
+    :param seed: The seed of the sample and of the tree.
+    :return: (the classes of the compiled tree, its arrays).
+    """
+    generator = random.Random(seed)
+    if rows is None:
+        rows = range(data.total_count)
+    sample = DataView(data, array('i', generator.choices(rows, k=len(rows))))
+    id3 = ID3(sample, seed=generator.getrandbits(32), cache=None, **options)
+    default = max(sample.class_counter.items(), key=lambda x: x[1])[0]
+    id3.generate_tree(sample, sample.get_all_attributes(), default)
+    compiled_tree = id3.compile()
+    return compiled_tree.classes, compiled_tree.get_arrays()
+
+
+# the state of a process of the pool, see _init_worker
+_worker_shared_memory = None
+_worker_data = None
+_worker_rows = None
+_worker_options = None
+
+
+def _init_worker(shared, rows, options):
+    """
+    Attach a process of the pool to the shared rows.
+    :param shared: The handle of the shared rows, see shared_data.
+    :param rows: The rows to sample from, None for all the rows.
+    :param options: The options of the trees.
+    :return: None.
+    """
+    global _worker_shared_memory, _worker_data, _worker_rows, _worker_options
+    _worker_shared_memory, _worker_data = attach_shared_data(shared)
+    _worker_rows = rows
+    _worker_options = options
+
+
+def _train_tree_in_worker(seed):
+    """
+    Train a tree in a process of the pool.
+    :param seed: The seed of the tree.
+    :return: (the classes of the compiled tree, its arrays).
+    """
+    return _train_tree(_worker_data, _worker_rows, _worker_options, seed)